@@ -1,6 +1,6 @@
 # encoding: utf-8
 
-# Currently, only "mongodb" is supported
+# "mongodb" or "sqlite" (embedded, no server needed)
 DB_TYPE = 'mongodb'
 
 # Name of the MongoDB database
@@ -10,4 +10,29 @@ DB_NAME = 'ris'
 DB_HOST = 'localhost'
 
 # MongoDB default port is 27017
-DB_PORT = 27017
\ No newline at end of file
+DB_PORT = 27017
+
+# Path of the SQLite database file, used if DB_TYPE is "sqlite"
+SQLITE_FILE = 'ris.sqlite'
+
+# JSON file with the config and body documents to import into the SQLite
+# database, e.g. {"config": {...}, "body": [{...}]}
+SQLITE_CONFIG_FILE = None
+
+# Compression of stored file contents ("zlib", or "zstd" if the zstandard
+# package is installed) per mime type, "text/*" matches all text types.
+# Content which doesn't get smaller is stored uncompressed. Off by default:
+# programs reading GridFS directly (e.g. the web frontend) must decompress
+# files with a compression field themselves. Example:
+# FILE_COMPRESSION = {
+#     'application/msword': 'zlib',
+#     'application/pdf': 'zlib',
+#     'application/rtf': 'zlib',
+#     'application/vnd.ms-excel': 'zlib',
+#     'text/*': 'zlib',
+# }
+FILE_COMPRESSION = {}
+
+# Records in the "changes" collection, which tell downstream consumers
+# what has been changed by a scraper run, expire after this many seconds
+CHANGES_TTL = 30 * 24 * 60 * 60
@@ -0,0 +1,268 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach, Ernesto Ruge
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Long running scraper process. Runs of the bodies given with --schedule
+# are started at their interval, and single jobs, e.g. a paper which has
+# to be scraped again right now, can be sent to a unix socket:
+#
+#     echo "--body 5123abcd... --paperid 4711" | nc -U risscraper.sock
+#
+# Every line sent is run like the arguments of main.py, before any
+# scheduled run which is still waiting, and answered with "ok" or
+# "error: <message>" when it is done. Jobs run one at a time. The database
+# connection, the body configurations and the compiled XPath expressions
+# and URL patterns are kept between jobs.
+
+import argparse
+import copy
+import itertools
+import logging
+import os
+import Queue
+import shlex
+import SocketServer
+import threading
+import time
+
+import main
+from risscraper import metrics
+
+
+# job priorities, lower ones run first
+URGENT = 0
+SCHEDULED = 1
+
+
+class Job(object):
+    """ Arguments of main.py to run, and the outcome when done """
+
+    def __init__(self, args):
+        self.args = args
+        self.done = threading.Event()
+        self.error = None
+
+
+class Daemon(object):
+
+    def __init__(self, schedule, run_args):
+        # body uid -> seconds between two scheduled runs
+        self.schedule = schedule
+        self.run_args = run_args
+        # (priority, sequence number, job)
+        self.jobs = Queue.PriorityQueue()
+        self.sequence = itertools.count()
+        # body uid -> config, scheduled runs load it again
+        self.configs = {}
+        self.db = None
+
+    def submit(self, args, priority=URGENT):
+        job = Job(args)
+        self.jobs.put((priority, next(self.sequence), job))
+        return job
+
+    def schedule_runs(self):
+        """
+        Submit the runs of the scheduled bodies when they are due, the
+        first ones right away. A body isn't submitted again while its
+        previous run is still waiting or running.
+        """
+        due = dict((body_uid, time.time()) for body_uid in self.schedule)
+        submitted = {}
+        while True:
+            now = time.time()
+            for body_uid, interval in self.schedule.iteritems():
+                job = submitted.get(body_uid)
+                if due[body_uid] > now or (job and not job.done.is_set()):
+                    continue
+                logging.info("Scheduled run of body %s", body_uid)
+                submitted[body_uid] = self.submit(
+                    ['--body', body_uid] + self.run_args, SCHEDULED)
+                due[body_uid] = now + interval
+            time.sleep(max(1, min(due.values()) - time.time()))
+
+    def work(self):
+        """ Run the submitted jobs, forever """
+        self.db = main.open_database()
+        while True:
+            try:
+                # blocking without timeout would ignore KeyboardInterrupt
+                priority, number, job = self.jobs.get(True, 60)
+            except Queue.Empty:
+                continue
+            self.run(job, reload_config=(priority == SCHEDULED))
+            job.done.set()
+
+    def run(self, job, reload_config=False):
+        start = time.time()
+        try:
+            options = main.get_parser().parse_args(job.args)
+        except SystemExit:
+            # argparse has written the reason to stderr
+            job.error = "invalid arguments, see main.py --help"
+            return
+        if options.backfill or options.erase_all:
+            job.error = "--backfill and --erase-all need main.py"
+            return
+        logging.info("Starting job %s", ' '.join(job.args))
+        root = logging.getLogger()
+        level = root.level
+        handlers = []
+        cached = config = None
+        try:
+            cached = self.configs.get(options.body_uid)
+            if cached is None or reload_config:
+                cached = self.db.get_config(options.body_uid)
+                self.configs[options.body_uid] = cached
+            # main.run() changes the configuration, e.g. the scraper type
+            config = copy.deepcopy(cached)
+            handlers = main.setup_logging(config, options)
+            self.db.setup(config)
+            metrics.reset()
+            main.run(config, self.db, options)
+        except SystemExit as e:
+            job.error = "exited with status %s" % e.code
+        except Exception as e:
+            logging.exception("Job %s failed", ' '.join(job.args))
+            job.error = "%s: %s" % (e.__class__.__name__, e)
+        finally:
+            if config is not None:
+                # a probed or dropped template fingerprint holds for the
+                # next jobs of the body, too
+                fingerprint = config['city'].get('templateFingerprint')
+                if fingerprint is None:
+                    cached['city'].pop('templateFingerprint', None)
+                else:
+                    cached['city']['templateFingerprint'] = fingerprint
+            # the next job logs to the log file of its own body
+            for handler in handlers:
+                root.removeHandler(handler)
+                handler.close()
+            root.setLevel(level)
+        logging.info("Job %s done in %.3fs", ' '.join(job.args),
+                     time.time() - start)
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """ Runs every line received as urgent job and answers when done """
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                args = shlex.split(line)
+            except ValueError as e:
+                self.wfile.write("error: %s\n" % e)
+                continue
+            job = self.server.scraper_daemon.submit(args)
+            job.done.wait()
+            if job.error is None:
+                self.wfile.write("ok\n")
+            else:
+                self.wfile.write("error: %s\n" % job.error)
+            self.wfile.flush()
+
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def parse_schedule(value):
+    """ Parse a --schedule value BODY_UID:MINUTES """
+    try:
+        body_uid, minutes = value.rsplit(':', 1)
+        return body_uid, int(minutes) * 60
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "%r is not BODY_UID:MINUTES" % value)
+
+
+def run_daemon():
+    parser = argparse.ArgumentParser(
+        description='Scrape Dein Ratsinformationssystem, as a daemon')
+    parser.add_argument('--socket', dest='socket', default='risscraper.sock',
+                        help='Path of the unix socket accepting jobs')
+    parser.add_argument('--schedule', dest='schedule', action='append',
+                        type=parse_schedule, default=[],
+                        help='Run the body with the given UID every MINUTES '
+                             'minutes. Format: "BODY_UID:MINUTES", can be '
+                             'given several times.')
+    parser.add_argument('--run-args', dest='run_args',
+                        default='--incremental',
+                        help='main.py arguments of scheduled runs, besides '
+                             '--body, e.g. --run-args="--incremental '
+                             '--parse-workers 4" (default: "--incremental")')
+    parser.add_argument('--logfile', dest='logfile', default=None,
+                        help='Log to this file instead of stderr')
+    parser.add_argument('--loglevel', dest='loglevel', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR',
+                                 'CRITICAL'])
+    options = parser.parse_args()
+
+    logging.basicConfig(
+        filename=options.logfile, level=getattr(logging, options.loglevel),
+        format='%(asctime)s %(name)s %(levelname)s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S')
+    logging.getLogger("requests").setLevel(logging.WARNING)
+    # jobs may lower the level of the root logger for their own log file
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(getattr(logging, options.loglevel))
+
+    daemon = Daemon(dict(options.schedule), shlex.split(options.run_args))
+    if os.path.exists(options.socket):
+        # left over by a daemon which didn't shut down
+        os.remove(options.socket)
+    server = Server(options.socket, RequestHandler)
+    server.scraper_daemon = daemon
+    os.chmod(options.socket, 0600)
+    threads = [threading.Thread(target=server.serve_forever)]
+    if daemon.schedule:
+        threads.append(threading.Thread(target=daemon.schedule_runs))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    logging.info("Daemon listening on %s", options.socket)
+    try:
+        daemon.work()
+    except KeyboardInterrupt:
+        logging.info("Daemon stopped")
+    finally:
+        os.remove(options.socket)
+
+
+if __name__ == '__main__':
+    run_daemon()
@@ -0,0 +1,1029 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach, Ernesto Ruge
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from copy import deepcopy
+import datetime
+from hashlib import md5, sha256
+import logging
+import types
+
+from bson.dbref import DBRef
+from bson.objectid import ObjectId
+
+import compression
+import hashing
+import slug
+
+
+class GraphNode(object):
+    """
+    An object collected by Database.save_graph(): its collection, its
+    dict and the nodes of the objects it references.
+    """
+
+    def __init__(self, object_type, data_dict):
+        self.type = object_type
+        self.dict = data_dict
+        self.refs = {}
+        self.document = None
+
+
+class Database(object):
+    """
+    Storage backend interface. Saving object graphs, content hashes, slugs
+    and backfill mode are implemented here on top of a few methods which
+    every backend has to provide (see the NotImplementedError ones below).
+
+    Documents are dicts as in MongoDB: they have an ObjectId as _id and
+    reference other documents with DBRefs. Updates are passed to backends
+    as MongoDB style {'$set': ..., '$unset': ...} dicts.
+    """
+
+    # Attributes which reference other objects, per collection, and the
+    # collections of the referenced objects.
+    REFERENCES = {
+        'person': {'membership': 'membership'},
+        'membership': {'organization': 'organization'},
+        'organization': {},
+        'meeting': {'organization': 'organization',
+                    'agendaItem': 'agendaItem',
+                    'invitation': 'file',
+                    'resultsProtocol': 'file',
+                    'verbatimProtocol': 'file',
+                    'auxiliaryFile': 'file'},
+        'agendaItem': {'consultation': 'consultation'},
+        'consultation': {'agendaItem': 'agendaItem',
+                         'paper': 'paper',
+                         'meeting': 'meeting'},
+        'paper': {'relatedPaper': 'paper',
+                  'mainFile': 'file',
+                  'auxiliaryFile': 'file',
+                  'originator': 'organization',
+                  'underDirectionOf': 'organization',
+                  'superordinatedPaper': 'paper',
+                  'subordinatedPaper': 'paper',
+                  'consultation': 'consultation'},
+        'file': {'masterFile': 'file'},
+    }
+
+    # Collections which contain documents of a body, see erase()
+    COLLECTIONS = ['agendaItem', 'consultation', 'file', 'legislativeTerm',
+                   'location', 'meeting', 'membership', 'organization',
+                   'paper', 'person']
+
+    # Fields of stored documents which are needed to save them again
+    STORED_FIELDS = {
+        'organization': ['slug'],
+        'file': ['file', 'depublication'],
+    }
+
+    def __init__(self, base_config, backfill=False):
+        self.base_config = base_config
+        # how often a new organization is tried again with a fresh slug
+        # if the unique slug index rejects it
+        self.slug_retries = 10
+        # mime type -> compression method of stored file contents
+        self.file_compression = getattr(base_config, 'FILE_COMPRESSION', {})
+        # Backfill mode for the initial import of a body: writes are not
+        # acknowledged, new documents are inserted in large unordered
+        # bulks and secondary indexes are built in finish().
+        self.backfill = backfill
+        self.backfill_batch_size = 1000
+        # (collection, originalId) -> stored fields of documents written
+        # in backfill mode, used instead of looking them up again. Only the
+        # pending batch and the one sent last are kept, earlier batches are
+        # checked to be stored and looked up like other documents (see
+        # flush_backfill()).
+        self.backfill_known = {}
+        self.backfill_sent = {}
+        # documents checked by check_backfill() and missing ones
+        self.backfill_checked = 0
+        self.backfill_missing = 0
+        # collection -> new documents not yet sent to the server
+        self.backfill_pending = {}
+        self.backfill_pending_by_id = {}
+        # collection -> listing hashes to send with the next backfill flush
+        self.backfill_listing_hashes = {}
+        # (collection, originalId) -> listing hash noted by find_changed(),
+        # stored once the detail page of the object has been saved
+        self.listing_hashes = {}
+        # change records are removed after this many seconds
+        self.changes_ttl = getattr(base_config, 'CHANGES_TTL',
+                                   30 * 24 * 60 * 60)
+        # highest values saved in this run, see note_high_water()
+        self.high_water = {}
+        self.config = None
+        self.body_uid = None
+        self.run_id = None
+
+    def setup(self, config):
+        """
+        Initialize database, if not yet done. Shouln't destroy anything.
+        """
+        # body
+        self.config = config
+        self.body_uid = config['city']['_id']
+        # identifies the changes of this run in the changes collection
+        self.run_id = ObjectId()
+        # a connection may be set up for several runs, see daemon.py
+        self.backfill_known = {}
+        self.backfill_sent = {}
+        self.backfill_checked = 0
+        self.backfill_missing = 0
+        self.backfill_pending = {}
+        self.backfill_pending_by_id = {}
+        self.backfill_listing_hashes = {}
+        self.listing_hashes = {}
+        self.high_water = {}
+
+    def finish(self):
+        """
+        Called when scraping is done. In backfill mode this sends the
+        remaining documents, builds the postponed indexes and verifies
+        that all documents arrived.
+        """
+        if not self.backfill:
+            return
+        self.flush_backfill(acknowledged=True)
+        logging.info("Backfill done, building indexes")
+        self.ensure_indexes()
+        self.verify_backfill()
+
+    # The following methods are implemented by the backends.
+
+    def ensure_indexes(self):
+        """
+        Create secondary indexes. In backfill mode this is postponed until
+        finish().
+        """
+        raise NotImplementedError
+
+    def erase(self):
+        """
+        Delete all data of the current body: its documents, queue jobs,
+        change records, slug counters and the file contents which aren't
+        referenced by other bodies.
+        """
+        raise NotImplementedError
+
+    def erase_all(self):
+        """ Delete all data from database. """
+        raise NotImplementedError
+
+    def get_config(self, body_uid):
+        """ Returns Config JSON """
+        raise NotImplementedError
+
+    def get_queue(self, name):
+        """ Return the job queue with the given name for the current body """
+        raise NotImplementedError
+
+    def queue_status(self):
+        """ Log the number of jobs per queue and status """
+        raise NotImplementedError
+
+    def save_result_string(self, result_string):
+        raise NotImplementedError
+
+    def save_fingerprint(self, fingerprint):
+        """
+        Store the template fingerprint (see risscraper.fingerprint) in the
+        document of the current body, or remove it if fingerprint is None.
+        """
+        raise NotImplementedError
+
+    def load_state(self):
+        """
+        Return the state document of the current body (the high-water
+        marks of --incremental), without body and _id, or {}.
+        """
+        raise NotImplementedError
+
+    def save_state(self, state):
+        """ Replace the state document of the current body """
+        raise NotImplementedError
+
+    def save_page(self, page):
+        """
+        Store an archived page document (see archive_page()), replacing the
+        page of the current body with the same kind and originalId.
+        """
+        raise NotImplementedError
+
+    def iter_pages(self, kind, batch_size=100):
+        """
+        Iterate over the archived page documents of the current body with
+        the given kind, as stored by save_page(), without body and _id.
+        Writes of the current process must not disturb the iteration.
+        """
+        raise NotImplementedError
+
+    def get_object(self, collection, key, value):
+        """ Return the document of the current body with key == value """
+        raise NotImplementedError
+
+    def iter_documents(self, collection, batch_size=1000):
+        """
+        Iterate over all documents of the current body in collection,
+        without contentHash, loading batch_size documents at a time. Must
+        be usable from several threads at once, see db.export.
+        """
+        raise NotImplementedError
+
+    def find_last_scraped(self, collection, original_ids):
+        """
+        Return (originalId, lastScraped) pairs for the documents of the
+        current body in collection whose originalId is in original_ids,
+        without loading the documents. lastScraped is None for documents
+        which have only been saved from listings.
+        """
+        raise NotImplementedError
+
+    def find_stored(self, collection, original_ids, fields):
+        """
+        Return the _id and the given fields of all documents of the current
+        body in collection whose originalId is in original_ids.
+        """
+        raise NotImplementedError
+
+    def fetch_documents(self, collection, oids):
+        """ Return the complete documents with the given _ids """
+        raise NotImplementedError
+
+    def find_listing_hashes(self, collection, original_ids):
+        """
+        Return (originalId, hash) pairs of the listing rows stored by
+        save_listing_hashes() for the given original_ids.
+        """
+        raise NotImplementedError
+
+    def save_listing_hashes(self, collection, hashes):
+        """
+        Store the hashes of listing rows, a dict of originalId -> hash, for
+        objects of the current body in collection.
+        """
+        raise NotImplementedError
+
+    def execute_bulk(self, collection, inserts, updates, acknowledged=True):
+        """
+        Insert documents and apply (_id, update) pairs for one collection.
+        Unacknowledged writes may be sent without waiting for the result.
+        """
+        raise NotImplementedError
+
+    def insert_changes(self, changes, acknowledged=True):
+        """ Store records for the changes collection """
+        raise NotImplementedError
+
+    def find_file_contents(self, blob_ids):
+        """
+        Return length, md5 (if known) and sha256 (if known) of the stored
+        file contents with the given _ids.
+        """
+        raise NotImplementedError
+
+    def store_file_content(self, content, digest, filename, mimetype=None):
+        """
+        Store file content addressed by its SHA-256 digest, or add a
+        reference to it if it is already stored, and return its _id. New
+        content is compressed with compress_file_content().
+        """
+        raise NotImplementedError
+
+    def load_file_content(self, blob_id):
+        """
+        Return the stored data of a file content and its compression
+        method (None if uncompressed).
+        """
+        raise NotImplementedError
+
+    def release_file_content(self, blob_id):
+        """ Drop one reference to stored file content """
+        raise NotImplementedError
+
+    def increment_slug_counter(self, key):
+        """ Increment the slug counter with the given key, return the count """
+        raise NotImplementedError
+
+    # Generic part
+
+    def dict_merge(self, a, b):
+        if not isinstance(b, dict):
+            return b
+        result = deepcopy(a)
+        for k, v in b.iteritems():
+            if k in result and isinstance(result[k], dict):
+                result[k] = self.dict_merge(result[k], v)
+            else:
+                result[k] = deepcopy(v)
+        return result
+
+    def find_stale(self, collection, original_ids, max_age=None):
+        """
+        Return the originalIds out of original_ids which are not stored yet
+        or, if max_age (a timedelta) is given, whose detail page hasn't been
+        scraped within max_age. Scrapers set lastScraped on objects loaded
+        from their detail page.
+        """
+        original_ids = list(original_ids)
+        if max_age is not None:
+            since = datetime.datetime.utcnow() - max_age
+        fresh = set()
+        for n in range(0, len(original_ids), self.backfill_batch_size):
+            for original_id, last_scraped in self.find_last_scraped(
+                    collection,
+                    original_ids[n:n + self.backfill_batch_size]):
+                if max_age is None:
+                    fresh.add(original_id)
+                elif (last_scraped is not None
+                      and hashing.utc_naive(last_scraped) >= since):
+                    fresh.add(original_id)
+        return [original_id for original_id in original_ids
+                if original_id not in fresh]
+
+    def find_changed(self, collection, listing, max_age=None):
+        """
+        Return the set of originalIds out of listing, a dict of originalId
+        -> hash of the object's row in a listing page, whose detail page
+        has to be fetched: objects whose detail page hasn't been scraped
+        yet (or within max_age, if given) and objects whose listing row
+        differs from the one seen before. New hashes are stored for the
+        next run once the detail page of the object has been saved (see
+        confirm_listing_hashes()), so a failed fetch is retried.
+        """
+        original_ids = list(listing)
+        if max_age is not None:
+            since = datetime.datetime.utcnow() - max_age
+        changed = set()
+        for n in range(0, len(original_ids), self.backfill_batch_size):
+            chunk = original_ids[n:n + self.backfill_batch_size]
+            scraped = dict(self.find_last_scraped(collection, chunk))
+            stored = dict(self.find_listing_hashes(collection, chunk))
+            for original_id in chunk:
+                last_scraped = scraped.get(original_id)
+                if stored.get(original_id) != listing[original_id]:
+                    self.listing_hashes[(collection, original_id)] = \
+                        listing[original_id]
+                    changed.add(original_id)
+                elif last_scraped is None:
+                    changed.add(original_id)
+                elif (max_age is not None
+                      and hashing.utc_naive(last_scraped) < since):
+                    changed.add(original_id)
+        return changed
+
+    def confirm_listing_hashes(self, documents):
+        """
+        Store the listing hashes noted by find_changed() for the documents
+        just saved from their detail page (those with lastScraped). In
+        backfill mode they are sent with the documents in flush_backfill().
+        """
+        confirmed = {}
+        for document in documents:
+            key = (document['type'], document['originalId'])
+            if (key in self.listing_hashes
+                    and 'lastScraped' in document['dict']):
+                confirmed.setdefault(document['type'], {})[
+                    document['originalId']] = self.listing_hashes.pop(key)
+        for collection, hashes in confirmed.iteritems():
+            if self.backfill:
+                self.backfill_listing_hashes.setdefault(
+                    collection, {}).update(hashes)
+            else:
+                self.save_listing_hashes(collection, hashes)
+
+    def note_high_water(self, key, value):
+        """ Remember the highest value of key saved in this run """
+        if value is None:
+            return
+        if key not in self.high_water or value > self.high_water[key]:
+            self.high_water[key] = value
+
+    def get_object_id(self, collection, key, value):
+        """ Return the ObjectID of a document in the given collection
+        identified by the given key:value pair.
+        """
+        result = self.get_object(collection, key, value)
+        if result is not None:
+            if '_id' in result:
+                return result['_id']
+
+    def meeting_exists(self, id):
+        return not self.find_stale('meeting', [id])
+
+    def agendaItem_exists(self, id):
+        return not self.find_stale('agendaItem', [id])
+
+    def document_exists(self, id):
+        return not self.find_stale('file', [id])
+
+    def paper_exists(self, id):
+        return not self.find_stale('paper', [id])
+
+    def save_graph(self, obj, object_type):
+        """
+        Write an object and all objects referenced by it to the database
+        and return the _id of the object.
+
+        All objects of the graph are collected first. Stored objects are
+        looked up with one query per collection, then DBRefs are filled in
+        and inserts and updates are sent in bulk, referenced collections
+        first.
+        """
+        nodes = []
+        root = self.collect_node(obj, object_type, nodes, {})
+
+        # objects which show up several times are stored only once
+        documents = []
+        by_key = {}
+        for node in nodes:
+            if 'originalId' in node.dict:
+                key = (node.type, node.dict['originalId'])
+            else:
+                key = (node.type, id(node))
+            if key not in by_key:
+                by_key[key] = {'type': node.type, 'nodes': [],
+                               'originalId': node.dict.get('originalId')}
+                documents.append(by_key[key])
+            by_key[key]['nodes'].append(node)
+            node.document = by_key[key]
+
+        # existing objects keep their _id, new objects get one in advance
+        self.lookup_documents(documents)
+        for document in documents:
+            if document['stored'] is not None:
+                document['_id'] = document['stored']['_id']
+            else:
+                document['_id'] = ObjectId()
+
+        # replace objects by DBRefs and merge objects of the same document
+        for document in documents:
+            document['dict'] = None
+            document['content'] = None
+            for node in document['nodes']:
+                for attribute, value in node.refs.iteritems():
+                    datatype = self.REFERENCES[node.type][attribute]
+                    if isinstance(value, list):
+                        value = [self.reference(item, datatype)
+                                 for item in value]
+                        node.dict[attribute] = [item for item in value
+                                                if item is not None]
+                    else:
+                        node.dict[attribute] = self.reference(value,
+                                                              datatype)
+                        if node.dict[attribute] is None:
+                            del node.dict[attribute]
+                if 'content' in node.dict:
+                    # file content is stored separately
+                    if node.dict['content']:
+                        document['content'] = node.dict['content']
+                    del node.dict['content']
+                if document['dict'] is None:
+                    # most documents consist of one node, which isn't copied
+                    document['dict'] = node.dict
+                else:
+                    document['dict'].update(node.dict)
+
+        self.store_file_contents([document for document in documents
+                                  if document['type'] == 'file'])
+        for document in documents:
+            if document['type'] == 'organization':
+                document['dict']['slug'] = self.create_slug(
+                    document['dict'], 'organization', document['stored'])
+
+        self.write_documents(documents)
+        return root.document['_id']
+
+    def collect_node(self, obj, object_type, nodes, visited):
+        """
+        Append obj and all objects referenced by it to nodes, referenced
+        objects first, and return the node of obj.
+        """
+        if id(obj) in visited:
+            return visited[id(obj)]
+        node = GraphNode(object_type, obj.dict())
+        visited[id(obj)] = node
+
+        # setting body
+        node.dict['body'] = DBRef(collection='body', id=self.body_uid)
+
+        # ensure that there is an originalId
+        if 'originalId' not in node.dict:
+            logging.critical("Fatal error: no originalId avaiable at url %s",
+                             node.dict.get('originalUrl'))
+
+        for attribute, datatype in self.REFERENCES[object_type].iteritems():
+            if attribute not in node.dict:
+                continue
+            value = node.dict[attribute]
+            if isinstance(value, list):
+                node.refs[attribute] = [
+                    self.collect_node(item, datatype, nodes, visited)
+                    if self.is_model(item) else item for item in value]
+            elif self.is_model(value):
+                node.refs[attribute] = self.collect_node(value, datatype,
+                                                         nodes, visited)
+            else:
+                node.refs[attribute] = value
+        nodes.append(node)
+        return node
+
+    def is_model(self, value):
+        return callable(getattr(value, 'dict', None))
+
+    def reference(self, value, datatype):
+        """ Return a DBRef for a collected node or an existing DBRef """
+        if isinstance(value, GraphNode):
+            return DBRef(collection=datatype, id=value.document['_id'])
+        if isinstance(value, DBRef):
+            return value
+        logging.warn("Ignoring invalid reference to %s: %r", datatype, value)
+        return None
+
+    def lookup_documents(self, documents):
+        """
+        Set document['stored'] to the stored parts of every document which
+        is already in the database (see STORED_FIELDS), using one query
+        per collection.
+        """
+        original_ids = {}
+        for document in documents:
+            document['stored'] = None
+            if document['originalId'] is None:
+                continue
+            key = (document['type'], document['originalId'])
+            if key in self.backfill_known:
+                document['stored'] = self.backfill_known[key]
+            elif key in self.backfill_sent:
+                document['stored'] = self.backfill_sent[key]
+            else:
+                original_ids.setdefault(document['type'], []).append(
+                    document['originalId'])
+        stored = {}
+        for collection, ids in original_ids.iteritems():
+            fields = ['originalId', 'contentHash']
+            fields += self.STORED_FIELDS.get(collection, [])
+            for data_stored in self.find_stored(collection, ids, fields):
+                stored.setdefault((collection, data_stored['originalId']),
+                                  data_stored)
+        for document in documents:
+            if document['stored'] is None:
+                document['stored'] = stored.get((document['type'],
+                                                 document['originalId']))
+
+    def store_file_contents(self, documents):
+        """
+        Store the content of file documents where necessary:
+        - If the file is new, its content is stored.
+        - If the content has changed, a new file version is added.
+          Content which is already stored is referenced instead of stored
+          again.
+        - If the file is depublished, no new content is stored.
+        """
+        blob_ids = [document['stored']['file'].id for document in documents
+                    if document['content'] and document['stored'] is not None
+                    and 'file' in document['stored']]
+        blobs = {}
+        if blob_ids:
+            for blob in self.find_file_contents(blob_ids):
+                blobs[blob['_id']] = blob
+
+        for document in documents:
+            file_dict = document['dict']
+            file_stored = document['stored']
+            content = document['content']
+            file_changed = False
+            file_data_stored = None
+            digest = None
+            if content:
+                digest = sha256(content).hexdigest()
+            if file_stored is not None:
+                # file exists in database and must be compared
+                logging.info("file %s is already in db with _id=%s",
+                             document['originalId'], file_stored['_id'])
+                # check if file is referenced
+                if 'file' in file_stored:
+                    # assuming DBRef in file_obj.file
+                    assert isinstance(file_stored['file'], DBRef)
+                    file_data_stored = blobs.get(file_stored['file'].id)
+                if file_data_stored is not None and content:
+                    # compare stored and submitted file
+                    if 'sha256' in file_data_stored:
+                        file_changed = file_data_stored['sha256'] != digest
+                    elif file_data_stored['length'] != len(content):
+                        file_changed = True
+                    elif (file_data_stored.get('md5')
+                          != md5(content).hexdigest()):
+                        file_changed = True
+                if file_data_stored is None and content:
+                    file_changed = True
+
+            # Create new file version (if necessary)
+            if ((file_changed and 'depublication' not in file_stored)
+                    or (file_stored is None)) and content:
+                file_oid = self.store_file_content(
+                    content, digest, file_dict.get('filename'),
+                    file_dict.get('mimetype'))
+                file_dict['file'] = DBRef(collection='fs.files', id=file_oid)
+                # The old version is kept, but isn't referenced by this
+                # file any more.
+                if file_data_stored is not None:
+                    self.release_file_content(file_data_stored['_id'])
+
+            # keep the reference to the current file version
+            if (file_stored is not None and 'file' not in file_dict
+                    and 'file' in file_stored):
+                file_dict['file'] = file_stored['file']
+
+    def compress_file_content(self, content, mimetype):
+        """
+        Return the data to store for a file content and the compression
+        method used, if any (see FILE_COMPRESSION in config.py). Content
+        which doesn't get noticeably smaller, like most PDFs with
+        compressed streams, is stored as it is.
+        """
+        method = compression.method_for(self.file_compression, mimetype)
+        if method is None:
+            return content, None
+        data = compression.compress(content, method)
+        if len(data) > len(content) * compression.MIN_RATIO:
+            return content, None
+        return data, method
+
+    def read_file_content(self, blob_id):
+        """ Return the content of a stored file, decompressed """
+        data, method = self.load_file_content(blob_id)
+        return compression.decompress(data, method)
+
+    def archive_page(self, kind, page):
+        """
+        Keep the raw HTML of a fetched detail page (a pipeline.Page), so it
+        can be parsed again later without the RIS (see --reparse). kind
+        names the parsed object, e.g. 'meeting'. The HTML is compressed as
+        configured for text/html in FILE_COMPRESSION, with zlib otherwise.
+        """
+        method = (compression.method_for(self.file_compression, 'text/html')
+                  or 'zlib')
+        self.save_page({
+            'kind': kind,
+            'originalId': page.original_id,
+            'url': page.url,
+            'finalUrl': page.final_url,
+            'fetched': datetime.datetime.utcnow(),
+            'compression': method,
+            'data': compression.compress(page.body, method)
+        })
+
+    def load_pages(self, kind):
+        """
+        Iterate over the archived pages of the current body with the given
+        kind. The decompressed HTML is in the field html.
+        """
+        for page in self.iter_pages(kind):
+            page['html'] = compression.decompress(page.pop('data'),
+                                                  page['compression'])
+            yield page
+
+    def write_documents(self, documents):
+        """
+        Insert new documents and update changed ones in bulk. Documents
+        whose content hash equals the stored one are not written at all.
+        The stored version of changed documents is loaded with one query
+        per collection and only changed keys are updated.
+        """
+        collections = []
+        inserts = {}
+        updates = {}
+        changed = {}
+        changes = []
+        for document in documents:
+            collection = document['type']
+            if collection not in collections:
+                collections.append(collection)
+                inserts[collection] = []
+                updates[collection] = []
+                changed[collection] = []
+            data_dict = document['dict']
+            data_stored = document['stored']
+            content_hash = hashing.content_hash(data_dict)
+            if data_stored is None:
+                data_dict['_id'] = document['_id']
+                data_dict['contentHash'] = content_hash
+                if self.backfill:
+                    self.backfill_insert(collection, data_dict)
+                else:
+                    inserts[collection].append(data_dict)
+                changes.append(self.change_record(collection, 'insert',
+                                                  data_dict))
+                logging.info("%s %s inserted as new", collection,
+                             document['_id'])
+            elif data_stored.get('contentHash') == content_hash:
+                logging.debug("%s %s with _id %s is unchanged", collection,
+                              document['originalId'], document['_id'])
+                if 'lastScraped' in data_dict:
+                    # only remember that the detail page has been scraped
+                    pending = self.backfill_pending_by_id.get(
+                        document['_id'])
+                    if pending is not None:
+                        pending['lastScraped'] = data_dict['lastScraped']
+                    else:
+                        updates[collection].append(
+                            (document['_id'],
+                             {'$set': {'lastScraped':
+                                       data_dict['lastScraped']}}))
+            elif self.backfill:
+                update = self.backfill_update(document)
+                if update is not None:
+                    updates[collection].append((document['_id'], update))
+                changes.append(self.change_record(collection, 'update',
+                                                  document['dict'],
+                                                  document['_id']))
+            else:
+                changed[collection].append(document)
+
+        for collection in collections:
+            if changed[collection]:
+                stored = {}
+                for data_stored in self.fetch_documents(
+                        collection, [document['_id'] for document
+                                     in changed[collection]]):
+                    stored[data_stored['_id']] = data_stored
+                for document in changed[collection]:
+                    set_attributes = self.diff_object(
+                        document['dict'], stored[document['_id']],
+                        collection)
+                    if 'lastScraped' in document['dict']:
+                        set_attributes['lastScraped'] = \
+                            document['dict']['lastScraped']
+                    if set_attributes != {}:
+                        updates[collection].append(
+                            (document['_id'], {'$set': set_attributes}))
+                    # only the content hash might have been missing
+                    if 'modified' in set_attributes:
+                        changes.append(self.change_record(
+                            collection, 'update', set_attributes,
+                            document['_id']))
+            self.execute_bulk(collection, inserts[collection],
+                              updates[collection],
+                              acknowledged=not self.backfill)
+        if changes:
+            if self.backfill:
+                self.backfill_pending.setdefault('changes', []).extend(
+                    changes)
+            else:
+                self.insert_changes(changes)
+        if self.listing_hashes:
+            self.confirm_listing_hashes(documents)
+        if self.backfill and (sum(len(pending) for pending
+                                  in self.backfill_pending.itervalues())
+                              >= self.backfill_batch_size):
+            self.flush_backfill()
+
+    def change_record(self, collection, operation, data_dict, oid=None):
+        """
+        Return a record for the changes collection, which tells downstream
+        consumers which documents have been changed in which run.
+        """
+        keys = [key for key in data_dict
+                if key not in hashing.HASH_EXCLUDE and key != 'body']
+        if oid is None:
+            oid = data_dict['_id']
+        return {'run': self.run_id,
+                'body': DBRef(collection='body', id=self.body_uid),
+                'collection': collection,
+                'id': oid,
+                'operation': operation,
+                'keys': sorted(keys),
+                'timestamp': datetime.datetime.utcnow()}
+
+    def backfill_insert(self, collection, data_dict):
+        """ Queue a new document in backfill mode """
+        self.backfill_pending.setdefault(collection, []).append(data_dict)
+        self.backfill_pending_by_id[data_dict['_id']] = data_dict
+        if 'originalId' in data_dict:
+            known = {'_id': data_dict['_id'],
+                     'originalId': data_dict['originalId'],
+                     'contentHash': data_dict['contentHash']}
+            for field in self.STORED_FIELDS.get(collection, []):
+                if field in data_dict:
+                    known[field] = data_dict[field]
+            self.backfill_known[(collection, data_dict['originalId'])] = known
+
+    def backfill_update(self, document):
+        """
+        Change a document written earlier in backfill mode. Documents which
+        haven't been sent yet are changed in place. Otherwise the stored
+        document is not loaded for a diff, all keys are $set and the content
+        hash is removed, so the next regular run compares it completely.
+        Returns the update to send, if any.
+        """
+        data_dict = dict((key, value) for key, value
+                         in document['dict'].iteritems() if key != 'created')
+        known = document['stored']
+        pending = self.backfill_pending_by_id.get(document['_id'])
+        if pending is not None:
+            pending.update(data_dict)
+            pending['contentHash'] = hashing.content_hash(pending)
+            known['contentHash'] = pending['contentHash']
+            return None
+        known['contentHash'] = None
+        return {'$set': data_dict, '$unset': {'contentHash': ''}}
+
+    def diff_object(self, data_dict, data_stored, object_type):
+        """
+        Compare a new document with the stored one and return the
+        attributes which have to be $set.
+        """
+        # compare old and new dict and then send update
+        logging.info("%s %s updated with _id %s", object_type,
+                     data_dict.get('originalId'), data_stored['_id'])
+        set_attributes = {}
+        for key in data_dict.keys():
+            if key in ['modified', 'created', 'lastScraped']:
+                continue
+            if key not in data_stored:
+                logging.debug("Key '%s' will be added to %s",
+                              key, object_type)
+                set_attributes[key] = data_dict[key]
+            elif data_stored[key] != data_dict[key]:
+                logging.debug("Key '%s' in %s has changed",
+                              key, object_type)
+                set_attributes[key] = data_dict[key]
+        if set_attributes != {}:
+            set_attributes['modified'] = data_dict['modified']
+        # The new document might contain less keys than the stored one
+        # (e.g. a paper which is only referenced by a consultation), so the
+        # hash has to be calculated over the result of the update.
+        data_stored.update(set_attributes)
+        stored_hash = hashing.content_hash(data_stored)
+        if stored_hash != data_stored.get('contentHash'):
+            set_attributes['contentHash'] = stored_hash
+        return set_attributes
+
+    def flush_backfill(self, acknowledged=False):
+        """ Send new documents collected in backfill mode """
+        for collection, inserts in self.backfill_pending.iteritems():
+            if not inserts:
+                continue
+            if collection == 'changes':
+                self.insert_changes(inserts, acknowledged=acknowledged)
+            else:
+                self.execute_bulk(collection, inserts, [],
+                                  acknowledged=acknowledged)
+            logging.info("Backfill: %d documents sent to %s",
+                         len(inserts), collection)
+        self.backfill_pending = {}
+        self.backfill_pending_by_id = {}
+        for collection, hashes in self.backfill_listing_hashes.iteritems():
+            self.save_listing_hashes(collection, hashes)
+        self.backfill_listing_hashes = {}
+        # The batch sent before this one had time to arrive. Once it is
+        # checked, its documents are looked up in the database again, so
+        # backfill_known doesn't grow with the whole body.
+        self.check_backfill(self.backfill_sent)
+        self.backfill_sent = self.backfill_known
+        self.backfill_known = {}
+
+    def check_backfill(self, known):
+        """
+        Check that the documents of a batch written in backfill mode (the
+        keys of known) are stored and count the missing ones.
+        """
+        original_ids = {}
+        for collection, original_id in known:
+            original_ids.setdefault(collection, []).append(original_id)
+        for collection, ids in original_ids.iteritems():
+            for n in range(0, len(ids), self.backfill_batch_size):
+                chunk = ids[n:n + self.backfill_batch_size]
+                found = set(data_stored['originalId'] for data_stored
+                            in self.find_stored(collection, chunk,
+                                                ['originalId']))
+                for original_id in chunk:
+                    if original_id not in found:
+                        logging.error("Backfill: %s %s is missing",
+                                      collection, original_id)
+                        self.backfill_missing += 1
+                self.backfill_checked += len(chunk)
+
+    def verify_backfill(self):
+        """
+        Check the batches written last in backfill mode and return the
+        number of documents of the run found missing. Earlier batches are
+        checked by flush_backfill().
+        """
+        self.check_backfill(self.backfill_sent)
+        self.check_backfill(self.backfill_known)
+        self.backfill_sent = {}
+        self.backfill_known = {}
+        if self.backfill_missing:
+            logging.error("Backfill verification: %d of %d documents "
+                          "missing, run again without --backfill",
+                          self.backfill_missing, self.backfill_checked)
+        else:
+            logging.info("Backfill verification: all %d documents stored",
+                         self.backfill_checked)
+        return self.backfill_missing
+
+    def create_slug(self, data_dict, object_type, data_stored=None):
+        """
+        Return a slug for the given object which is unique within the body.
+        Stored objects keep their slug. For new objects a counter per
+        slugified originalId is incremented, so allocating a slug is a
+        single round trip even if lots of objects share the same name.
+        """
+        if data_stored is not None and data_stored.get('slug'):
+            return data_stored['slug']
+        base_slug = self.slugify(data_dict['originalId'])
+        count = self.increment_slug_counter(
+            '%s/%s/%s' % (self.body_uid, object_type, base_slug))
+        if count == 1:
+            return base_slug
+        return "%s-%s" % (base_slug, count - 1)
+
+    def save_person(self, person):
+        """ Write person and its memberships to DB and return ObjectID """
+        return self.save_graph(person, 'person')
+
+    def save_membership(self, membership):
+        """ Write membership to DB and return ObjectID """
+        return self.save_graph(membership, 'membership')
+
+    def save_organization(self, organization):
+        """ Write organization to DB and return ObjectID """
+        return self.save_graph(organization, 'organization')
+
+    def save_meeting(self, meeting):
+        """ Write meeting object to database. This means dereferencing
+        all associated objects as DBrefs.
+        """
+        if isinstance(meeting.start, datetime.datetime):
+            self.note_high_water('meetingStart',
+                                 hashing.utc_naive(meeting.start))
+        return self.save_graph(meeting, 'meeting')
+
+    def save_agendaItem(self, agendaitem):
+        """ Write agendaitem object to database. This means
+        dereferencing all associated objects as DBrefs.
+        """
+        return self.save_graph(agendaitem, 'agendaItem')
+
+    def save_consultation(self, consultation):
+        """ Write consultation object to database. This means
+        dereferencing all associated objects as DBrefs.
+        """
+        return self.save_graph(consultation, 'consultation')
+
+    def save_paper(self, paper):
+        """Write paper to DB and return ObjectID"""
+        if isinstance(paper.originalId, (int, long)):
+            self.note_high_water('paperId', paper.originalId)
+        return self.save_graph(paper, 'paper')
+
+    def save_file(self, file_obj):
+        """
+        Write file to DB and return ObjectID. The file content is stored
+        separately, see store_file_contents().
+        """
+        return self.save_graph(file_obj, 'file')
+
+    def slugify(self, identifier):
+        return slug.slugify(identifier)
+
+    def merge_dict(self, x, y):
+        merged = dict(x, **y)
+        xkeys = x.keys()
+        for key in xkeys:
+            if isinstance(x[key], types.DictType) and y.has_key(key):
+                merged[key] = self.merge_dict(x[key], y[key])
+        return merged
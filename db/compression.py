@@ -0,0 +1,85 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach, Ernesto Ruge
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# compressed content is only stored if it saves at least 10%
+MIN_RATIO = 0.9
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def method_for(config, mimetype):
+    """
+    Return the compression method for content of the given mime type
+    according to config (see FILE_COMPRESSION in config.py), or None.
+    Keys are mime types like "application/pdf" or "text/*".
+    """
+    if not config or not mimetype:
+        return None
+    method = config.get(mimetype)
+    if method is None:
+        method = config.get(mimetype.split('/')[0] + '/*')
+    if method == 'zstd' and zstandard is None:
+        # the zstandard package is optional
+        method = 'zlib'
+    return method
+
+
+def compress(content, method):
+    if method == 'zlib':
+        return zlib.compress(content, ZLIB_LEVEL)
+    if method == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(content)
+    raise ValueError("Unknown compression method %r" % method)
+
+
+def decompress(data, method):
+    if method is None:
+        return data
+    if method == 'zlib':
+        return zlib.decompress(data)
+    if method == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstandard is needed to read zstd compressed "
+                             "content")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError("Unknown compression method %r" % method)
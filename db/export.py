@@ -0,0 +1,152 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach, Ernesto Ruge
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import datetime
+import json
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+
+from bson.dbref import DBRef
+from bson.objectid import ObjectId
+
+
+# OParl object types of the exported collections
+OPARL_TYPES = {
+    'person': 'https://schema.oparl.org/1.0/Person',
+    'membership': 'https://schema.oparl.org/1.0/Membership',
+    'organization': 'https://schema.oparl.org/1.0/Organization',
+    'meeting': 'https://schema.oparl.org/1.0/Meeting',
+    'agendaItem': 'https://schema.oparl.org/1.0/AgendaItem',
+    'consultation': 'https://schema.oparl.org/1.0/Consultation',
+    'paper': 'https://schema.oparl.org/1.0/Paper',
+    'file': 'https://schema.oparl.org/1.0/File',
+}
+
+
+def json_default(value):
+    """ Serialize the values json doesn't know """
+    if isinstance(value, DBRef):
+        # the collection follows from the attribute, see Database.REFERENCES
+        return unicode(value.id)
+    if isinstance(value, ObjectId):
+        return unicode(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError("%r is not JSON serializable" % value)
+
+
+class Exporter(object):
+    """
+    Writes the documents of the current body as OParl shaped JSON Lines,
+    one file per collection (e.g. paper.jsonl). Documents are streamed
+    from the database in batches, so memory use doesn't depend on the
+    size of the body. References are replaced by the id of the referenced
+    object.
+
+    With files, the (decompressed) file contents are written to the
+    subdirectory files, named by the file field of the file objects.
+    """
+
+    def __init__(self, db, directory, workers=1, batch_size=1000,
+                 files=False):
+        self.db = db
+        self.directory = directory
+        self.workers = workers
+        self.batch_size = batch_size
+        self.files = files
+
+    def export(self):
+        """ Export all collections, workers collections at a time """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        collections = sorted(OPARL_TYPES)
+        if self.workers > 1:
+            pool = ThreadPool(self.workers)
+            try:
+                counts = pool.map(self.export_collection, collections)
+            finally:
+                pool.close()
+        else:
+            counts = [self.export_collection(collection)
+                      for collection in collections]
+        if self.files:
+            # not in the pool, database connections may not be shared
+            self.export_file_contents()
+        return dict(zip(collections, counts))
+
+    def export_file_contents(self):
+        """ Write the content of every file object, decompressed """
+        directory = os.path.join(self.directory, 'files')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        count = 0
+        for document in self.db.iter_documents('file', self.batch_size):
+            if 'file' not in document:
+                continue
+            blob_id = document['file'].id
+            path = os.path.join(directory, unicode(blob_id))
+            if os.path.exists(path):
+                # the same content belongs to several file objects
+                continue
+            temp_path = path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(self.db.read_file_content(blob_id))
+            os.rename(temp_path, path)
+            count += 1
+        logging.info("Exported %d file contents to %s", count, directory)
+
+    def export_collection(self, collection):
+        """ Write one collection and return the number of objects """
+        path = os.path.join(self.directory, '%s.jsonl' % collection)
+        # consumers never see a half written file
+        temp_path = path + '.tmp'
+        count = 0
+        with open(temp_path, 'w') as f:
+            for document in self.db.iter_documents(collection,
+                                                   self.batch_size):
+                f.write(json.dumps(self.oparl_object(collection, document),
+                                   default=json_default, sort_keys=True))
+                f.write('\n')
+                count += 1
+        os.rename(temp_path, path)
+        logging.info("Exported %d objects to %s", count, path)
+        return count
+
+    def oparl_object(self, collection, document):
+        data = dict((key, value) for key, value in document.iteritems()
+                    if key not in ('_id', 'contentHash'))
+        data['id'] = unicode(document['_id'])
+        data['type'] = OPARL_TYPES[collection]
+        return data
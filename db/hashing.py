@@ -0,0 +1,77 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach, Ernesto Ruge
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import datetime
+from hashlib import sha1
+import json
+
+import pytz
+
+# keys which don't describe the content of an object
+HASH_EXCLUDE = frozenset(['_id', 'created', 'modified', 'contentHash',
+                          'lastScraped'])
+
+
+def utc_naive(value):
+    """ Return a datetime as naive datetime in UTC, None stays None """
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(pytz.utc).replace(tzinfo=None)
+    return value
+
+
+def canonical_value(value):
+    """ Return a JSON compatible representation of values json doesn't know """
+    if isinstance(value, datetime.datetime):
+        value = utc_naive(value)
+        # MongoDB stores milliseconds only
+        value = value.replace(microsecond=value.microsecond // 1000 * 1000)
+        return value.isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if hasattr(value, 'collection') and hasattr(value, 'id'):
+        # DBRef
+        return {'$ref': value.collection, '$id': unicode(value.id)}
+    return unicode(value)
+
+
+def content_hash(data_dict):
+    """
+    Return a hash over the content of a document. Two documents with the
+    same keys and values (except bookkeeping keys like created/modified)
+    have the same hash, no matter where they come from.
+    """
+    content = dict((key, value) for key, value in data_dict.iteritems()
+                   if key not in HASH_EXCLUDE)
+    return sha1(json.dumps(content, sort_keys=True,
+                           default=canonical_value)).hexdigest()
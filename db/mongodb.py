@@ -32,42 +32,66 @@ NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-from copy import deepcopy
-import datetime
-from hashlib import md5
 import logging
-import re
 from uuid import uuid4
-import types
 
+from bson.binary import Binary
 from bson.dbref import DBRef
 from bson.objectid import ObjectId
 import gridfs
-import pytz
-import translitcodec
+import gridfs.errors
 
-from pymongo import MongoClient
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import (BulkWriteError, DuplicateKeyError,
+                             OperationFailure)
 
+from base import Database
+import hashing
+from risscraper.queue import Queue
 
-class MongoDatabase(object):
+
+class MongoDatabase(Database):
     """
     Database handler for a MongoDB backend
     """
 
-    def __init__(self, base_config):
-        client = MongoClient(base_config.DB_HOST, base_config.DB_PORT)
+    # name of the unique index on the slugs of organizations of a body
+    SLUG_INDEX = 'body_1_slug_1'
+
+    def __init__(self, base_config, backfill=False):
+        super(MongoDatabase, self).__init__(base_config, backfill=backfill)
+        # tz_aware: stored datetimes are compared with localized ones
+        client = MongoClient(base_config.DB_HOST, base_config.DB_PORT,
+                             tz_aware=True)
         self.db = client[base_config.DB_NAME]
-        self.base_config = base_config
         self.fs = gridfs.GridFS(self.db)
-        self.slugify_re = re.compile(r'[\t !"#$%&\'()*\-/<=>?@\[\\\]^_`{|},.]+')
 
     def setup(self, config):
         """
         Initialize database, if not yet done. Shouln't destroy anything.
         """
-        # body
-        self.config = config
-        self.body_uid = config['city']['_id']
+        super(MongoDatabase, self).setup(config)
+
+        # stored objects are looked up by originalId when saving. With
+        # lastScraped the index covers the queries of find_stale().
+        for collection in self.REFERENCES:
+            self.db[collection].ensure_index([('body', ASCENDING),
+                                              ('originalId', ASCENDING),
+                                              ('lastScraped', ASCENDING)])
+        # listing hashes are compared per body and collection
+        self.db.listing.ensure_index([('body', ASCENDING),
+                                      ('collection', ASCENDING),
+                                      ('originalId', ASCENDING)],
+                                     unique=True)
+        # archived pages are replaced and read per body and kind
+        self.db.page.ensure_index([('body', ASCENDING), ('kind', ASCENDING),
+                                   ('originalId', ASCENDING)], unique=True)
+        # queue jobs are fetched and erased per body
+        self.db.queue.ensure_index([('body_uid', ASCENDING),
+                                    ('qname', ASCENDING),
+                                    ('status', ASCENDING)])
+        if not self.backfill:
+            self.ensure_indexes()
 
         """
         self.db.committee.ensure_index([('originalId', ASCENDING),
@@ -98,6 +122,68 @@ class MongoDatabase(object):
         """
 
     def erase(self):
+        """
+        Delete all data of the current body. Documents are removed using the
+        (body, originalId) indexes, GridFS files only lose the references of
+        the body and are removed when nobody references them any more.
+        """
+        body = DBRef('body', id=self.body_uid)
+        batch_size = self.backfill_batch_size
+        references = {}
+        for file_stored in self.db.file.find(
+                {'body': body, 'file': {'$exists': True}}, ['file']):
+            blob_id = file_stored['file'].id
+            references[blob_id] = references.get(blob_id, 0) + 1
+        by_count = {}
+        for blob_id, count in references.iteritems():
+            by_count.setdefault(count, []).append(blob_id)
+        for count, blob_ids in by_count.iteritems():
+            for n in range(0, len(blob_ids), batch_size):
+                self.db.fs.files.update(
+                    {'_id': {'$in': blob_ids[n:n + batch_size]},
+                     'refCount': {'$exists': True}},
+                    {'$inc': {'refCount': -count}}, multi=True)
+        blob_ids = references.keys()
+        # GridFS files stored before reference counting was introduced
+        # belong to a single file document
+        unused_query = {'$or': [{'refCount': {'$lte': 0}},
+                                {'refCount': {'$exists': False}}]}
+        removed = 0
+        for n in range(0, len(blob_ids), batch_size):
+            unused = [blob['_id'] for blob in self.db.fs.files.find(
+                dict(unused_query, _id={'$in': blob_ids[n:n + batch_size]}),
+                ['_id'])]
+            removed += self.remove_file_contents(unused)
+        logging.info("Erased %d of %d GridFS files referenced by body %s",
+                     removed, len(blob_ids), self.body_uid)
+        # GridFS files of the body no file document references any more,
+        # i.e. replaced file versions
+        orphans = [blob['_id'] for blob in self.db.fs.files.find(
+            dict(unused_query, body=body), ['_id'])]
+        removed = 0
+        for n in range(0, len(orphans), batch_size):
+            removed += self.remove_file_contents(orphans[n:n + batch_size])
+        logging.info("Erased %d unreferenced GridFS files of body %s",
+                     removed, self.body_uid)
+        for collection in self.COLLECTIONS:
+            self.db[collection].remove({'body': body})
+        self.db.queue.remove({'body_uid': self.body_uid})
+        self.db.page.remove({'body': body})
+        self.db.listing.remove({'body': body})
+        self.db.state.remove({'body': body})
+        self.db.changes.remove({'body': body})
+        self.db.slug_counter.remove({'body': body})
+        logging.info("Erased body %s", self.body_uid)
+
+    def remove_file_contents(self, blob_ids):
+        """ Remove GridFS files with their chunks, return their number """
+        if not blob_ids:
+            return 0
+        self.db.fs.chunks.remove({'files_id': {'$in': blob_ids}})
+        self.db.fs.files.remove({'_id': {'$in': blob_ids}})
+        return len(blob_ids)
+
+    def erase_all(self):
         """ Delete all data from database. """
         self.db.queue.remove({})
         self.db.agendaItem.remove({})
@@ -112,6 +198,11 @@ class MongoDatabase(object):
         self.db.person.remove({})
         self.db.fs.files.remove({})
         self.db.fs.chunks.remove({})
+        self.db.page.remove({})
+        self.db.listing.remove({})
+        self.db.state.remove({})
+        self.db.changes.remove({})
+        self.db.slug_counter.remove({})
 
     def get_config(self, body_uid):
         """ Returns Config JSON """
@@ -125,23 +216,42 @@ class MongoDatabase(object):
         config['city'] = local_config
         return config
 
-    def dict_merge(self, a, b):
-        if not isinstance(b, dict):
-            return b
-        result = deepcopy(a)
-        for k, v in b.iteritems():
-            if k in result and isinstance(result[k], dict):
-                result[k] = self.dict_merge(result[k], v)
-            else:
-                result[k] = deepcopy(v)
-        return result
-
     def save_result_string(self, result_string):
         random_uid = uuid4()
         self.db.body.config.scraper.result_strings.insert(
             {'from': result_string, 'to': random_uid})
         return random_uid
 
+    def save_fingerprint(self, fingerprint):
+        if fingerprint is None:
+            update = {'$unset': {'templateFingerprint': ''}}
+        else:
+            update = {'$set': {'templateFingerprint': fingerprint}}
+        self.db.body.update({'_id': self.body_uid}, update)
+
+    def load_state(self):
+        state = self.db.state.find_one(
+            {'body': DBRef('body', id=self.body_uid)},
+            {'_id': False, 'body': False})
+        return state or {}
+
+    def save_state(self, state):
+        body = DBRef('body', id=self.body_uid)
+        self.db.state.update({'body': body}, dict(state, body=body),
+                             upsert=True)
+
+    def save_page(self, page):
+        page = dict(page, body=DBRef('body', id=self.body_uid),
+                    data=Binary(page['data']))
+        self.db.page.update({'body': page['body'], 'kind': page['kind'],
+                             'originalId': page['originalId']},
+                            page, upsert=True)
+
+    def iter_pages(self, kind, batch_size=100):
+        return self.db.page.find(
+            {'body': DBRef('body', id=self.body_uid), 'kind': kind},
+            {'_id': False, 'body': False}).batch_size(batch_size)
+
     def get_object(self, collection, key, value):
         """
         Return a document
@@ -150,373 +260,175 @@ class MongoDatabase(object):
             {key: value, 'body': DBRef('body', id=self.body_uid)})
         return result
 
-    def get_object_id(self, collection, key, value):
-        """ Return the ObjectID of a document in the given collection
-        identified by the given key:value pair.
-        """
-        result = self.get_object(collection, key, value)
-        if result is not None:
-            if '_id' in result:
-                return result['_id']
-
-    def meeting_exists(self, id):
-        if self.get_object_id('meeting', 'externalId', id) is not None:
-            return True
-        return False
-
-    def agendaItem_exists(self, id):
-        if self.get_object_id('agendaItem', 'externalId', id) is not None:
-            return True
-        return False
-
-    def document_exists(self, id):
-        if self.get_object_id('document', 'externalId', id) is not None:
-            return True
-        return False
-
-    def paper_exists(self, id):
-        if self.get_object_id('paper', 'externalId', id) is not None:
-            return True
-        return False
-
-    def dereference_object(self, data_dict, attribute, datatype=False):
-        if attribute in data_dict:
-            # replace object datasets with DBRef dicts
-            if datatype:
-                save_funct = getattr(self, 'save_' + datatype)
-            else:
-                save_funct = getattr(self, 'save_' + attribute)
-                datatype = attribute
-            if isinstance(data_dict[attribute], list):
-                for n in range(len(data_dict[attribute])):
-                    oid = save_funct(data_dict[attribute][n])
-                    data_dict[attribute][n] = DBRef(collection=datatype, id=oid)
+    def get_queue(self, name):
+        return Queue(name, self.config, self)
+
+    def iter_documents(self, collection, batch_size=1000):
+        return self.db[collection].find(
+            {'body': DBRef('body', id=self.body_uid)},
+            {'contentHash': False}).batch_size(batch_size)
+
+    def find_last_scraped(self, collection, original_ids):
+        for data_stored in self.db[collection].find(
+                {'originalId': {'$in': original_ids},
+                 'body': DBRef('body', id=self.body_uid)},
+                {'_id': False, 'originalId': True, 'lastScraped': True}):
+            yield data_stored['originalId'], data_stored.get('lastScraped')
+
+    def find_stored(self, collection, original_ids, fields):
+        return self.db[collection].find(
+            {'originalId': {'$in': original_ids},
+             'body': DBRef('body', id=self.body_uid)}, fields)
+
+    def fetch_documents(self, collection, oids):
+        return self.db[collection].find({'_id': {'$in': oids}})
+
+    def find_listing_hashes(self, collection, original_ids):
+        for listing in self.db.listing.find(
+                {'body': DBRef('body', id=self.body_uid),
+                 'collection': collection,
+                 'originalId': {'$in': original_ids}},
+                {'_id': False, 'originalId': True, 'hash': True}):
+            yield listing['originalId'], listing['hash']
+
+    def save_listing_hashes(self, collection, hashes):
+        body = DBRef('body', id=self.body_uid)
+        bulk = self.db.listing.initialize_unordered_bulk_op()
+        for original_id, listing_hash in hashes.iteritems():
+            bulk.find({'body': body, 'collection': collection,
+                       'originalId': original_id}).upsert().update(
+                {'$set': {'hash': listing_hash}})
+        bulk.execute()
+
+    def execute_bulk(self, collection, inserts, updates, acknowledged=True):
+        """ Send inserts and updates for one collection in one bulk """
+        if not inserts and not updates:
+            return
+        bulk = self.db[collection].initialize_unordered_bulk_op()
+        for data_dict in inserts:
+            bulk.insert(data_dict)
+        for oid, update in updates:
+            bulk.find({'_id': oid}).update_one(update)
+        try:
+            if not acknowledged:
+                bulk.execute(write_concern={'w': 0})
             else:
-                oid = save_funct(data_dict[attribute])
-                data_dict[attribute] = DBRef(collection=datatype, id=oid)
-        return data_dict
-
-    def save_object(self, data_dict, data_stored, object_type):
-        # new object
-        if data_stored is None:
-            # insert new document
-            datatable = getattr(self.db, object_type)
-            oid = datatable.insert(data_dict)
-            logging.info("%s %s inserted as new", object_type, oid)
-            return oid
-        # update object
-        else:
-            # compare old and new dict and then send update
-            logging.info("%s %s updated with _id %s", object_type,
-                         data_dict['originalId'], data_stored['_id'])
-            set_attributes = {}
-            for key in data_dict.keys():
-                if key in ['modified', 'created']:
-                    continue
-                if key not in data_stored:
-                    logging.debug("Key '%s' will be added to %s",
-                                  key, object_type)
-                    set_attributes[key] = data_dict[key]
-                else:
-                    # add utc info to datetime objects
-                    if isinstance(data_stored[key], datetime.datetime):
-                        data_stored[key] = pytz.utc.localize(data_stored[key])
-                    if data_stored[key] != data_dict[key]:
-                        logging.debug("Key '%s' in %s has changed",
-                                      key, object_type)
-                        set_attributes[key] = data_dict[key]
-            if set_attributes != {}:
-                set_attributes['modified'] = data_dict['modified']
-                datatable = getattr(self.db, object_type)
-                datatable.update({'_id': data_stored['_id']},
-                                 {'$set': set_attributes})
-            return data_stored['_id']
-
-    def ensure_index(self, ):
-        pass
-
-    def create_slug(self, data_dict, object_type):
-        current_slug = self.slugify(data_dict['originalId'])
-        slug_counter = 0
-        while True:
-            dataset = self.get_object(object_type, 'slug', current_slug)
-            if dataset:
-                if data_dict['originalId'] != dataset['originalId']:
-                    slug_counter += 1
-                    current_slug = ("%s-%s"
-                                    % (self.slugify(data_dict['originalId']),
-                                       slug_counter))
-                else:
-                    return current_slug
-            else:
-                return current_slug
-
-    def save_person(self, person):
-        person_stored = self.get_object('person', 'originalId',
-                                        person.originalId)
-
-        person_dict = person.dict()
-
-        # setting body
-        person_dict['body'] = DBRef(collection='body', id=self.body_uid)
-
-        # ensure that there is an originalId
-        if 'originalId' not in person_dict:
-            logging.critical("Fatal error: no originalId avaiable at url %s",
-                             person_dict.originalUrl)
-
-        # dereference objects
-        person_dict = self.dereference_object(person_dict, 'membership')
-
-        # save data
-        return self.save_object(person_dict, person_stored, 'person')
-
-    def save_membership(self, membership):
-        membership_stored = self.get_object('membership', 'originalId',
-                                            membership.originalId)
-
-        membership_dict = membership.dict()
-
-        # setting body
-        membership_dict['body'] = DBRef(collection='body', id=self.body_uid)
-
-        # ensure that there is an originalId
-        if 'originalId' not in membership_dict:
-            logging.critical("Fatal error: no originalId avaiable at url %s",
-                             membership_dict.originalUrl)
-
-        # dereference objects
-        membership_dict = self.dereference_object(membership_dict,
-                                                  'organization')
-
-        # save data
-        return self.save_object(membership_dict, membership_stored,
-                                'membership')
-
-    def save_organization(self, organization):
-        organization_stored = self.get_object('organization', 'originalId',
-                                              organization.originalId)
-        organization_dict = organization.dict()
-
-        # setting body
-        organization_dict['body'] = DBRef(collection='body', id=self.body_uid)
-
-        # ensure that there is an originalId
-        if 'originalId' not in organization_dict:
-            logging.critical("Fatal error: no originalId avaiable at url %s",
-                             organization_dict.originalUrl)
-
-        # create slug
-        organization_dict['slug'] = self.create_slug(organization_dict,
-                                                     'committee')
-
-        # save data
-        return self.save_object(organization_dict, organization_stored,
-                                'organization')
-
-    def save_meeting(self, meeting):
-        """ Write meeting object to database. This means dereferencing
-        all associated objects as DBrefs.
+                bulk.execute()
+        except BulkWriteError as e:
+            # The slug counter might hand out a slug which is already taken
+            # by organizations stored before it existed. The unique index
+            # catches that and we simply try the next one.
+            if e.details.get('writeConcernErrors'):
+                raise
+            for error in e.details['writeErrors']:
+                if (collection != 'organization'
+                        or not self.is_slug_conflict(error)):
+                    raise
+            for error in e.details['writeErrors']:
+                self.insert_organization(error['op'])
+
+    def is_slug_conflict(self, error):
         """
-        meeting_stored = self.get_object('meeting', 'originalId',
-                                         meeting.originalId)
-        meeting_dict = meeting.dict()
-
-        # setting body
-        meeting_dict['body'] = DBRef(collection='body', id=self.body_uid)
-
-        # ensure that there is an originalId
-        if 'originalId' not in meeting_dict:
-            logging.critical("Fatal error: no originalId avaiable at url %s",
-                             meeting_dict.originalUrl)
-
-        # dereference items
-        meeting_dict = self.dereference_object(meeting_dict, 'organization')
-        meeting_dict = self.dereference_object(meeting_dict, 'agendaItem')
-        meeting_dict = self.dereference_object(meeting_dict,
-                                               'invitation', 'file')
-        meeting_dict = self.dereference_object(meeting_dict,
-                                               'resultsProtocol', 'file')
-        meeting_dict = self.dereference_object(meeting_dict,
-                                               'verbatimProtocol', 'file')
-        meeting_dict = self.dereference_object(meeting_dict,
-                                               'auxiliaryFile', 'file')
-
-        # save data
-        return self.save_object(meeting_dict, meeting_stored, 'meeting')
-
-    def save_agendaItem(self, agendaitem):
-        """ Write agendaitem object to database. This means
-        dereferencing all associated objects as DBrefs.
+        Tell whether a write error is a duplicate key in the slug index,
+        not e.g. a duplicate _id
         """
-        agendaitem_stored = self.get_object('agendaItem', 'originalId',
-                                            agendaitem.originalId)
-        agendaitem_dict = agendaitem.dict()
-
-        # setting body
-        agendaitem_dict['body'] = DBRef(collection='body', id=self.body_uid)
-
-        if 'originalId' not in agendaitem_dict:
-            logging.critical("Fatal error: no originalId avaiable at url %s",
-                             agendaitem_dict.originalUrl)
-
-        # dereference items
-        agendaitem_dict = self.dereference_object(agendaitem_dict, 'consultation')
-
-        return self.save_object(agendaitem_dict, agendaitem_stored, 'agendaItem')
-
-    def save_consultation(self, consultation):
-        """ Write consultation object to database. This means
-        dereferencing all associated objects as DBrefs.
+        if error.get('code') != 11000:
+            return False
+        if error.get('keyPattern') is not None:
+            return sorted(error['keyPattern']) == ['body', 'slug']
+        return self.SLUG_INDEX in error.get('errmsg', '')
+
+    def insert_organization(self, data_dict):
+        """ Insert an organization, trying new slugs if necessary """
+        for n in range(self.slug_retries):
+            logging.info("Slug %s is already taken, trying again",
+                         data_dict['slug'])
+            data_dict['slug'] = self.create_slug(data_dict, 'organization')
+            data_dict['contentHash'] = hashing.content_hash(data_dict)
+            try:
+                return self.db.organization.insert(data_dict)
+            except DuplicateKeyError as e:
+                if self.SLUG_INDEX not in str(e):
+                    raise
+        logging.critical("Unable to find a free slug for organization %s",
+                         data_dict['originalId'])
+        raise DuplicateKeyError("No free slug for organization %s"
+                                % data_dict['originalId'])
+
+    def insert_changes(self, changes, acknowledged=True):
+        if acknowledged:
+            self.db.changes.insert(changes)
+        else:
+            self.db.changes.insert(changes, w=0)
+
+    def ensure_indexes(self):
+        # slugs have to be unique per body. Older databases might contain
+        # duplicates, then the index can't be built until they are fixed.
+        try:
+            self.db.organization.ensure_index([('body', ASCENDING),
+                                               ('slug', ASCENDING)],
+                                              unique=True, sparse=True,
+                                              name=self.SLUG_INDEX)
+        except OperationFailure as e:
+            logging.warn("Unable to create unique slug index on "
+                         "organization: %s", e)
+        # change records expire
+        self.db.changes.ensure_index([('timestamp', ASCENDING)],
+                                     expireAfterSeconds=self.changes_ttl)
+
+    def find_file_contents(self, blob_ids):
+        return self.db.fs.files.find({'_id': {'$in': blob_ids}},
+                                     ['length', 'md5', 'sha256'])
+
+    def store_file_content(self, content, digest, filename, mimetype=None):
         """
-        consultation_stored = self.get_object('consultation', 'originalId',
-                                              consultation.originalId)
-        consultation_dict = consultation.dict()
-
-        # setting body
-        consultation_dict['body'] = DBRef(collection='body', id=self.body_uid)
-
-        if 'originalId' not in consultation_dict:
-            logging.critical("Fatal error: no originalId avaiable at url %s",
-                             consultation_dict.originalUrl)
-
-        # dereference items
-        consultation_dict = self.dereference_object(consultation_dict,
-                                                    'agendaItem', 'agendaItem')
-        consultation_dict = self.dereference_object(consultation_dict,
-                                                    'paper')
-        consultation_dict = self.dereference_object(consultation_dict,
-                                                    'meeting', 'meeting')
-
-        return self.save_object(consultation_dict, consultation_stored,
-                                'consultation')
-
-    def save_paper(self, paper):
-        """Write paper to DB and return ObjectID"""
-        paper_stored = self.get_object('paper', 'originalId', paper.originalId)
-        paper_dict = paper.dict()
-
-        paper_dict['body'] = DBRef(collection='body', id=self.body_uid)
-
-        if 'originalId' not in paper_dict:
-            logging.critical("Fatal error: no originalId avaiable at url %s",
-                             paper_dict.originalUrl)
-
-        # dereference items
-        paper_dict = self.dereference_object(paper_dict,
-                                             'relatedPaper', 'paper')
-        paper_dict = self.dereference_object(paper_dict,
-                                             'mainFile', 'file')
-        paper_dict = self.dereference_object(paper_dict,
-                                             'auxiliaryFile', 'file')
-        paper_dict = self.dereference_object(paper_dict,
-                                             'originator', 'organization')
-        paper_dict = self.dereference_object(paper_dict,
-                                             'underDirectionOf', 'organization')
-        paper_dict = self.dereference_object(paper_dict,
-                                             'superordinatedPaper', 'paper')
-        paper_dict = self.dereference_object(paper_dict,
-                                             'subordinatedPaper', 'paper')
-        paper_dict = self.dereference_object(paper_dict,
-                                             'consultation', 'consultation')
-
-        return self.save_object(paper_dict, paper_stored, 'paper')
-
-
-    def save_file(self, file_obj):
+        Store file content in GridFS and return the _id of the GridFS file.
+        GridFS files are addressed by the SHA-256 digest of their content
+        and carry a reference count, so content which is already stored
+        (e.g. the same PDF attached to a paper and to several agenda items)
+        only becomes another reference. Compressed content has the fields
+        compression and rawLength.
         """
-        Write file to DB and return ObjectID.
-        - If the file already exists, the existing file
-            is updated in the database.
-        - If the file_obj.content has changed, a new GridFS file version
-            is added.
-        - If file_obj is depublished, no new file is stored.
+        blob = self.db.fs.files.find_and_modify(
+            query={'_id': digest}, update={'$inc': {'refCount': 1}},
+            fields=['_id'])
+        if blob is not None:
+            logging.info("File content already stored with _id=%s", digest)
+            return digest
+        data, method = self.compress_file_content(content, mimetype)
+        metadata = {}
+        if method is not None:
+            metadata = {'compression': method, 'rawLength': len(content)}
+        try:
+            self.fs.put(data, _id=digest, filename=filename,
+                        body=DBRef('body', self.body_uid), sha256=digest,
+                        refCount=1, **metadata)
+            logging.info("New file version stored with _id=%s", digest)
+        except gridfs.errors.FileExists:
+            # someone else stored the same content in the meantime
+            self.db.fs.files.update({'_id': digest},
+                                    {'$inc': {'refCount': 1}})
+        return digest
+
+    def load_file_content(self, blob_id):
+        grid_out = self.fs.get(blob_id)
+        return grid_out.read(), getattr(grid_out, 'compression', None)
+
+    def release_file_content(self, blob_id):
         """
-        file_stored = self.get_object('file', 'originalId', file_obj.originalId)
-        file_dict = file_obj.dict()
-
-        file_dict['body'] = DBRef(collection='body', id=self.body_uid)
-
-        if 'originalId' not in file_dict:
-            logging.critical("Fatal error: no originalId avaiable at url %s",
-                             paper_dict.originalUrl)
-
-        file_dict = self.dereference_object(file_dict, 'masterFile', 'file')
-
-        file_changed = False
-        if file_stored is not None:
-            # file exists in database and must be compared field by field
-            logging.info("file %s is already in db with _id=%s",
-                         file_obj.originalId, file_stored['_id'])
-            # check if file is referenced
-            file_data_stored = None
-            if 'file' in file_stored:
-                # assuming DBRef in file_obj.file
-                assert isinstance(file_stored['file'], DBRef)
-                file_data_stored = self.db.fs.files.find_one(
-                    {'_id': file_stored['file'].id})
-            if file_data_stored is not None and file_obj.content:
-                # compare stored and submitted file
-                if file_data_stored['length'] != len(file_obj.content):
-                    file_changed = True
-                elif file_data_stored['md5'] != md5(
-                        file_obj.content).hexdigest():
-                    file_changed = True
-            if file_data_stored is None and file_obj.content:
-                file_changed = True
-
-        # Create new file version (if necessary)
-        if ((file_changed and 'depublication' not in file_stored)
-                or (file_stored is None)) and file_obj.content:
-            file_oid = self.fs.put(file_obj.content,
-                                   filename=file_obj.filename,
-                                   body=DBRef('body', self.body_uid))
-            logging.info("New file version stored with _id=%s", file_oid)
-            file_dict['file'] = DBRef(collection='fs.files', id=file_oid)
-
-        # erase file content (since stored elsewhere above)
-        if 'content' in file_dict:
-            del file_dict['content']
-
-        oid = None
-        if file_stored is None:
-            # insert new
-            oid = self.db.file.insert(file_dict)
-            logging.info("File %s inserted with _id %s",
-                         file_obj.originalId, oid)
-        else:
-            # Only do partial update
-            oid = file_stored['_id']
-            set_attributes = {}
-            for key in file_dict.keys():
-                if key in ['modified', 'created']:
-                    continue
-                if key not in file_stored:
-                    set_attributes[key] = file_dict[key]
-                else:
-                    # add utc info to datetime objects
-                    if isinstance(file_stored[key], datetime.datetime):
-                        file_stored[key] = pytz.utc.localize(file_stored[key])
-                    if file_stored[key] != file_dict[key]:
-                        logging.debug("Key '%s' will be updated", key)
-                        set_attributes[key] = file_dict[key]
-            if 'file' not in file_dict and 'file' in file_stored:
-                set_attributes['file'] = file_stored['file']
-            if file_changed or set_attributes != {}:
-                set_attributes['modified'] = file_dict['modified']
-                self.db.file.update({'_id': oid}, {'$set': set_attributes})
-        return oid
-
-    def slugify(self, identifier):
-        identifier = unicode(identifier)
-        identifier = identifier.replace('/', '-')
-        identifier = identifier.replace(' ', '-')
-        result = []
-        for word in self.slugify_re.split(identifier.lower()):
-            word = word.encode('translit/long')
-            if word:
-                result.append(word)
-        return unicode('-'.join(result))
+        Drop one reference to a GridFS file. GridFS files stored before
+        reference counting was introduced are left untouched.
+        """
+        self.db.fs.files.update({'_id': blob_id,
+                                 'refCount': {'$exists': True}},
+                                {'$inc': {'refCount': -1}})
+
+    def increment_slug_counter(self, key):
+        counter = self.db.slug_counter.find_and_modify(
+            query={'_id': key,
+                   'body': DBRef(collection='body', id=self.body_uid)},
+            update={'$inc': {'count': 1}}, upsert=True, new=True)
+        return counter['count']
 
     def queue_status(self):
         """
@@ -540,11 +452,3 @@ class MongoDatabase(object):
         for entry in aggregate['result']:
             logging.info("Queue %s, status %s: %d jobs", entry['_id']['qname'],
                          entry['_id']['status'], entry['count'])
-
-    def merge_dict(self, x, y):
-        merged = dict(x, **y)
-        xkeys = x.keys()
-        for key in xkeys:
-            if isinstance(x[key], types.DictType) and y.has_key(key):
-                merged[key] = self.merge_dict(x[key], y[key])
-        return merged
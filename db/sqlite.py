@@ -0,0 +1,682 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach, Ernesto Ruge
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import datetime
+import logging
+import sqlite3
+from uuid import uuid4
+
+from bson import json_util
+
+from base import Database
+import hashing
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS object (
+    id TEXT PRIMARY KEY,
+    collection TEXT NOT NULL,
+    body TEXT NOT NULL,
+    original_id TEXT,
+    content_hash TEXT,
+    slug TEXT,
+    last_scraped TIMESTAMP,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS object_original_id
+    ON object (collection, body, original_id, last_scraped);
+CREATE TABLE IF NOT EXISTS blob (
+    id TEXT PRIMARY KEY,
+    body TEXT,
+    filename TEXT,
+    length INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    ref_count INTEGER NOT NULL,
+    compression TEXT,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run TEXT NOT NULL,
+    body TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    object_id TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    data TEXT NOT NULL,
+    timestamp TIMESTAMP NOT NULL
+);
+CREATE TABLE IF NOT EXISTS slug_counter (
+    id TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS queue (
+    body TEXT NOT NULL,
+    qname TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT,
+    status TEXT NOT NULL,
+    failures INTEGER NOT NULL,
+    modified TIMESTAMP NOT NULL,
+    PRIMARY KEY (body, qname, key)
+);
+CREATE TABLE IF NOT EXISTS state (
+    body TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS listing (
+    body TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    original_id TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (body, collection, original_id)
+);
+CREATE TABLE IF NOT EXISTS page (
+    body TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    original_id TEXT NOT NULL,
+    url TEXT,
+    final_url TEXT,
+    fetched TIMESTAMP NOT NULL,
+    compression TEXT,
+    data BLOB NOT NULL,
+    PRIMARY KEY (body, kind, original_id)
+);
+CREATE TABLE IF NOT EXISTS config (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS body (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS result_string (
+    id TEXT PRIMARY KEY,
+    string TEXT NOT NULL
+);
+"""
+
+# parameters are the columns returned by SQLiteDatabase.object_row()
+INSERT_OBJECT = ('INSERT INTO object (id, collection, body, original_id, '
+                 'content_hash, slug, last_scraped, data) '
+                 'VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+UPDATE_OBJECT = ('UPDATE object SET original_id = ?, content_hash = ?, '
+                 'slug = ?, last_scraped = ?, data = ? WHERE id = ?')
+
+# SQLite doesn't accept more than 999 parameters per statement
+MAX_PARAMETERS = 500
+
+
+def dumps(data):
+    """ Serialize a document, keeping ObjectIds, DBRefs and datetimes """
+    return json_util.dumps(data, sort_keys=True)
+
+
+def loads(text):
+    return json_util.loads(text)
+
+
+def chunks(values):
+    values = list(values)
+    for n in range(0, len(values), MAX_PARAMETERS):
+        yield values[n:n + MAX_PARAMETERS]
+
+
+class SQLiteDatabase(Database):
+    """
+    Database handler for an embedded SQLite database, for small bodies and
+    for development without a MongoDB server.
+
+    All documents are stored in the object table as JSON (MongoDB extended
+    JSON, so ObjectIds, DBRefs and datetimes survive). The fields used in
+    queries are kept in columns next to it. File contents are stored in the
+    blob table.
+    """
+
+    def __init__(self, base_config, backfill=False):
+        super(SQLiteDatabase, self).__init__(base_config, backfill=backfill)
+        self.connection = sqlite3.connect(
+            base_config.SQLITE_FILE, detect_types=sqlite3.PARSE_DECLTYPES)
+        # readers (e.g. an API) don't block the scraper and vice versa
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        if backfill:
+            # a crash during the initial import means starting over anyway
+            self.connection.execute('PRAGMA synchronous=OFF')
+        else:
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        config_file = getattr(base_config, 'SQLITE_CONFIG_FILE', None)
+        if config_file:
+            self.load_config(config_file)
+
+    def load_config(self, config_file):
+        """
+        Import the configuration from a JSON file with the keys "config"
+        (the config document) and "body" (a list of body documents), both
+        as exported from MongoDB.
+        """
+        with open(config_file) as f:
+            data = loads(f.read())
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO config (id, data) VALUES (1, ?)',
+                (dumps(data['config']),))
+            for body in data['body']:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO body (id, data) VALUES (?, ?)',
+                    (unicode(body['_id']), dumps(body)))
+
+    def setup(self, config):
+        """
+        Initialize database, if not yet done. Shouln't destroy anything.
+        """
+        super(SQLiteDatabase, self).setup(config)
+        if not self.backfill:
+            self.ensure_indexes()
+        # there is no TTL index, expired change records are removed here
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM changes WHERE timestamp < ?',
+                (datetime.datetime.utcnow()
+                 - datetime.timedelta(seconds=self.changes_ttl),))
+
+    def ensure_indexes(self):
+        # slugs have to be unique per body
+        try:
+            self.connection.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS object_slug '
+                'ON object (collection, body, slug) WHERE slug IS NOT NULL')
+        except sqlite3.IntegrityError as e:
+            logging.warn("Unable to create unique slug index on "
+                         "organization: %s", e)
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS changes_timestamp '
+            'ON changes (timestamp)')
+
+    def erase(self):
+        """
+        Delete all data of the current body. Blobs only lose the references
+        of the body and are removed when nobody references them any more.
+        """
+        body = unicode(self.body_uid)
+        references = {}
+        for row in self.connection.execute(
+                'SELECT data FROM object WHERE collection = ? AND body = ?',
+                ('file', body)):
+            file_stored = loads(row[0])
+            if 'file' in file_stored:
+                blob_id = file_stored['file'].id
+                references[blob_id] = references.get(blob_id, 0) + 1
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE blob SET ref_count = ref_count - ? WHERE id = ?',
+                [(count, blob_id) for blob_id, count
+                 in references.iteritems()])
+            for chunk in chunks(references):
+                self.connection.execute(
+                    'DELETE FROM blob WHERE ref_count <= 0 AND id IN (%s)'
+                    % ', '.join('?' * len(chunk)), chunk)
+            # blobs of the body no file references any more, i.e.
+            # replaced file versions
+            self.connection.execute(
+                'DELETE FROM blob WHERE ref_count <= 0 AND body = ?', (body,))
+            for collection in self.COLLECTIONS:
+                self.connection.execute(
+                    'DELETE FROM object WHERE collection = ? AND body = ?',
+                    (collection, body))
+            for table in ['queue', 'page', 'listing', 'state', 'changes',
+                          'slug_counter']:
+                self.connection.execute(
+                    'DELETE FROM %s WHERE body = ?' % table, (body,))
+        logging.info("Erased body %s", self.body_uid)
+
+    def erase_all(self):
+        """ Delete all data from database. """
+        with self.connection:
+            for table in ['queue', 'object', 'blob', 'page', 'listing',
+                          'state', 'changes', 'slug_counter']:
+                self.connection.execute('DELETE FROM %s' % table)
+
+    def get_config(self, body_uid):
+        """ Returns Config JSON """
+        row = self.connection.execute(
+            'SELECT data FROM config WHERE id = 1').fetchone()
+        config = loads(row[0])
+        if '_id' in config:
+            del config['_id']
+        row = self.connection.execute('SELECT data FROM body WHERE id = ?',
+                                      (unicode(body_uid),)).fetchone()
+        local_config = loads(row[0])
+        if 'config' in local_config:
+            config = self.merge_dict(config, local_config['config'])
+            del local_config['config']
+        config['city'] = local_config
+        return config
+
+    def save_result_string(self, result_string):
+        random_uid = uuid4()
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO result_string (id, string) VALUES (?, ?)',
+                (unicode(random_uid), result_string))
+        return random_uid
+
+    def save_fingerprint(self, fingerprint):
+        with self.connection:
+            row = self.connection.execute(
+                'SELECT data FROM body WHERE id = ?',
+                (unicode(self.body_uid),)).fetchone()
+            body = loads(row[0])
+            if fingerprint is None:
+                body.pop('templateFingerprint', None)
+            else:
+                body['templateFingerprint'] = fingerprint
+            self.connection.execute('UPDATE body SET data = ? WHERE id = ?',
+                                    (dumps(body), unicode(self.body_uid)))
+
+    def load_state(self):
+        row = self.connection.execute(
+            'SELECT data FROM state WHERE body = ?',
+            (unicode(self.body_uid),)).fetchone()
+        if row is None:
+            return {}
+        return loads(row[0])
+
+    def save_state(self, state):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO state (body, data) VALUES (?, ?)',
+                (unicode(self.body_uid), dumps(state)))
+
+    def save_page(self, page):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO page (body, kind, original_id, url, '
+                'final_url, fetched, compression, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (unicode(self.body_uid), page['kind'],
+                 dumps(page['originalId']), page['url'], page['finalUrl'],
+                 page['fetched'], page['compression'],
+                 sqlite3.Binary(page['data'])))
+
+    def iter_pages(self, kind, batch_size=100):
+        # committing on self.connection would reset the cursor
+        connection = sqlite3.connect(self.base_config.SQLITE_FILE,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        try:
+            cursor = connection.execute(
+                'SELECT original_id, url, final_url, fetched, compression, '
+                'data FROM page WHERE body = ? AND kind = ?',
+                (unicode(self.body_uid), kind))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield {'kind': kind, 'originalId': loads(row[0]),
+                           'url': row[1], 'finalUrl': row[2],
+                           'fetched': row[3], 'compression': row[4],
+                           'data': str(row[5])}
+        finally:
+            connection.close()
+
+    def get_object(self, collection, key, value):
+        """
+        Return a document
+        """
+        if key == 'originalId':
+            rows = self.connection.execute(
+                'SELECT data FROM object WHERE collection = ? AND body = ? '
+                'AND original_id = ?',
+                (collection, unicode(self.body_uid), dumps(value)))
+        else:
+            rows = self.connection.execute(
+                'SELECT data FROM object WHERE collection = ? AND body = ?',
+                (collection, unicode(self.body_uid)))
+        for row in rows:
+            data = loads(row[0])
+            if data.get(key) == value:
+                return data
+        return None
+
+    def get_queue(self, name):
+        return SQLiteQueue(name, self.config, self)
+
+    def queue_status(self):
+        """
+        Prints out information on the queue
+        """
+        for qname, status, count in self.connection.execute(
+                'SELECT qname, status, count(*) FROM queue '
+                'GROUP BY body, qname, status ORDER BY body'):
+            logging.info("Queue %s, status %s: %d jobs", qname, status, count)
+
+    def iter_documents(self, collection, batch_size=1000):
+        # sqlite3 connections can't be shared between threads, and in WAL
+        # mode readers don't block the writer
+        connection = sqlite3.connect(self.base_config.SQLITE_FILE)
+        try:
+            cursor = connection.execute(
+                'SELECT data FROM object WHERE collection = ? AND body = ?',
+                (collection, unicode(self.body_uid)))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    data = loads(row[0])
+                    data.pop('contentHash', None)
+                    yield data
+        finally:
+            connection.close()
+
+    def find_last_scraped(self, collection, original_ids):
+        # answered from the object_original_id index alone
+        for chunk in chunks(original_ids):
+            for original_id, last_scraped in self.connection.execute(
+                    'SELECT original_id, last_scraped FROM object '
+                    'WHERE collection = ? AND body = ? '
+                    'AND original_id IN (%s)' % ', '.join('?' * len(chunk)),
+                    [collection, unicode(self.body_uid)]
+                    + [dumps(original_id) for original_id in chunk]):
+                yield loads(original_id), last_scraped
+
+    def find_stored(self, collection, original_ids, fields):
+        fields = ['_id'] + fields
+        for chunk in chunks(original_ids):
+            for row in self.connection.execute(
+                    'SELECT data FROM object WHERE collection = ? '
+                    'AND body = ? AND original_id IN (%s)'
+                    % ', '.join('?' * len(chunk)),
+                    [collection, unicode(self.body_uid)]
+                    + [dumps(original_id) for original_id in chunk]):
+                data = loads(row[0])
+                yield dict((field, data[field]) for field in fields
+                           if field in data)
+
+    def find_listing_hashes(self, collection, original_ids):
+        for chunk in chunks(original_ids):
+            for original_id, listing_hash in self.connection.execute(
+                    'SELECT original_id, hash FROM listing '
+                    'WHERE body = ? AND collection = ? '
+                    'AND original_id IN (%s)' % ', '.join('?' * len(chunk)),
+                    [unicode(self.body_uid), collection]
+                    + [dumps(original_id) for original_id in chunk]):
+                yield loads(original_id), listing_hash
+
+    def save_listing_hashes(self, collection, hashes):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO listing '
+                '(body, collection, original_id, hash) VALUES (?, ?, ?, ?)',
+                [(unicode(self.body_uid), collection, dumps(original_id),
+                  listing_hash)
+                 for original_id, listing_hash in hashes.iteritems()])
+
+    def fetch_documents(self, collection, oids):
+        for chunk in chunks(oids):
+            for row in self.connection.execute(
+                    'SELECT data FROM object WHERE id IN (%s)'
+                    % ', '.join('?' * len(chunk)),
+                    [unicode(oid) for oid in chunk]):
+                yield loads(row[0])
+
+    def object_row(self, collection, data_dict):
+        """ Return the columns of the object table for a document """
+        original_id = None
+        if 'originalId' in data_dict:
+            original_id = dumps(data_dict['originalId'])
+        last_scraped = None
+        if 'lastScraped' in data_dict:
+            last_scraped = hashing.utc_naive(data_dict['lastScraped'])
+        return (unicode(data_dict['_id']), collection,
+                unicode(self.body_uid), original_id,
+                data_dict.get('contentHash'), data_dict.get('slug'),
+                last_scraped, dumps(data_dict))
+
+    def execute_bulk(self, collection, inserts, updates, acknowledged=True):
+        """
+        Send inserts and updates for one collection in one transaction.
+        All writes are acknowledged, SQLite runs in process.
+        """
+        if not inserts and not updates:
+            return
+        with self.connection:
+            for data_dict in inserts:
+                try:
+                    self.connection.execute(
+                        INSERT_OBJECT, self.object_row(collection, data_dict))
+                except sqlite3.IntegrityError:
+                    # see MongoDatabase.execute_bulk()
+                    if collection != 'organization':
+                        raise
+                    self.insert_organization(data_dict)
+            if updates:
+                stored = {}
+                for data_stored in self.fetch_documents(
+                        collection, [oid for oid, update in updates]):
+                    stored[data_stored['_id']] = data_stored
+                for oid, update in updates:
+                    data_dict = stored[oid]
+                    data_dict.update(update.get('$set', {}))
+                    for key in update.get('$unset', {}):
+                        data_dict.pop(key, None)
+                    row = self.object_row(collection, data_dict)
+                    self.connection.execute(UPDATE_OBJECT,
+                                            row[3:] + row[:1])
+
+    def insert_organization(self, data_dict):
+        """ Insert an organization, trying new slugs if necessary """
+        for n in range(self.slug_retries):
+            logging.info("Slug %s is already taken, trying again",
+                         data_dict['slug'])
+            data_dict['slug'] = self.create_slug(data_dict, 'organization')
+            data_dict['contentHash'] = hashing.content_hash(data_dict)
+            try:
+                self.connection.execute(
+                    INSERT_OBJECT, self.object_row('organization', data_dict))
+                return data_dict['_id']
+            except sqlite3.IntegrityError:
+                pass
+        logging.critical("Unable to find a free slug for organization %s",
+                         data_dict['originalId'])
+        raise sqlite3.IntegrityError("No free slug for organization %s"
+                                     % data_dict['originalId'])
+
+    def insert_changes(self, changes, acknowledged=True):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO changes (run, body, collection, object_id, '
+                'operation, data, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(unicode(change['run']), unicode(change['body'].id),
+                  change['collection'], unicode(change['id']),
+                  change['operation'], dumps(change), change['timestamp'])
+                 for change in changes])
+
+    def find_file_contents(self, blob_ids):
+        for chunk in chunks(blob_ids):
+            for blob_id, length, digest in self.connection.execute(
+                    'SELECT id, length, sha256 FROM blob WHERE id IN (%s)'
+                    % ', '.join('?' * len(chunk)), chunk):
+                yield {'_id': blob_id, 'length': length, 'sha256': digest}
+
+    def store_file_content(self, content, digest, filename, mimetype=None):
+        """
+        Store file content in the blob table and return its _id. Like in
+        GridFS (see MongoDatabase.store_file_content()), blobs are addressed
+        by the SHA-256 digest of their content and carry a reference count.
+        The length column is the length of the uncompressed content.
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                'UPDATE blob SET ref_count = ref_count + 1 WHERE id = ?',
+                (digest,))
+            if cursor.rowcount:
+                logging.info("File content already stored with _id=%s",
+                             digest)
+                return digest
+            data, method = self.compress_file_content(content, mimetype)
+            self.connection.execute(
+                'INSERT INTO blob (id, body, filename, length, sha256, '
+                'ref_count, compression, data) '
+                'VALUES (?, ?, ?, ?, ?, 1, ?, ?)',
+                (digest, unicode(self.body_uid), filename, len(content),
+                 digest, method, sqlite3.Binary(data)))
+        logging.info("New file version stored with _id=%s", digest)
+        return digest
+
+    def load_file_content(self, blob_id):
+        row = self.connection.execute(
+            'SELECT data, compression FROM blob WHERE id = ?',
+            (blob_id,)).fetchone()
+        return str(row[0]), row[1]
+
+    def release_file_content(self, blob_id):
+        """ Drop one reference to a blob """
+        with self.connection:
+            self.connection.execute(
+                'UPDATE blob SET ref_count = ref_count - 1 WHERE id = ?',
+                (blob_id,))
+
+    def increment_slug_counter(self, key):
+        with self.connection:
+            cursor = self.connection.execute(
+                'UPDATE slug_counter SET count = count + 1 WHERE id = ?',
+                (key,))
+            if not cursor.rowcount:
+                self.connection.execute(
+                    'INSERT INTO slug_counter (id, body, count) '
+                    'VALUES (?, ?, 1)', (key, unicode(self.body_uid)))
+        row = self.connection.execute(
+            'SELECT count FROM slug_counter WHERE id = ?', (key,)).fetchone()
+        return row[0]
+
+
+class SQLiteQueue(object):
+    """
+    Job queue in the queue table of an SQLiteDatabase, see
+    risscraper.queue.Queue for the interface.
+    """
+
+    def __init__(self, name, config, db):
+        self.name = name
+        self.config = config
+        self.connection = db.connection
+        self.body = unicode(config['city']['_id'])
+
+    def has_next(self):
+        if len(self) > 0:
+            return True
+        return False
+
+    def add(self, key_or_element):
+        payload = None
+        if isinstance(key_or_element, dict):
+            key = key_or_element['key']
+            if 'payload' in key_or_element:
+                payload = dumps(key_or_element['payload'])
+        else:
+            key = key_or_element
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO queue (body, qname, key, payload, '
+                'status, failures, modified) VALUES (?, ?, ?, ?, ?, 0, ?)',
+                (self.body, self.name, dumps(key), payload, 'OPEN',
+                 datetime.datetime.utcnow()))
+
+    def get(self):
+        """
+        Return the next OPEN job and mark it as IN_PROGRESS. Raises a
+        KeyError if there is none.
+        """
+        with self.connection:
+            row = self.connection.execute(
+                'SELECT key, payload FROM queue WHERE body = ? AND qname = ? '
+                'AND status = ? LIMIT 1',
+                (self.body, self.name, 'OPEN')).fetchone()
+            if row is None:
+                raise KeyError(self.name)
+            self.set_status(row[0], 'IN_PROGRESS')
+        out = {'key': loads(row[0])}
+        if row[1] is not None:
+            out['payload'] = loads(row[1])
+        return out
+
+    def __len__(self):
+        """
+        Returns the number of OPEN jobs
+        """
+        return self.connection.execute(
+            'SELECT count(*) FROM queue WHERE body = ? AND qname = ? '
+            'AND status = ?', (self.body, self.name, 'OPEN')).fetchone()[0]
+
+    def set_status(self, key, status):
+        self.connection.execute(
+            'UPDATE queue SET status = ?, modified = ? WHERE body = ? '
+            'AND qname = ? AND key = ?',
+            (status, datetime.datetime.utcnow(), self.body, self.name, key))
+
+    def resolve_job(self, key_or_element):
+        """
+        Mark a job as "DONE". The job can be either indicated
+        by a dict with a "key" element or a key int/string directly
+        """
+        if isinstance(key_or_element, dict):
+            key_or_element = key_or_element['key']
+        with self.connection:
+            self.set_status(dumps(key_or_element), 'DONE')
+
+    def mark_failed(self, key_or_element):
+        """
+        Add 1 to the failure count of a job.
+        If the failure count reaches 3, set the job status
+        to "FAILED".
+        """
+        if isinstance(key_or_element, dict):
+            key_or_element = key_or_element['key']
+        with self.connection:
+            self.connection.execute(
+                'UPDATE queue SET failures = failures + 1, '
+                'status = CASE WHEN failures >= 2 THEN ? ELSE status END '
+                'WHERE body = ? AND qname = ? AND key = ?',
+                ('FAILED', self.body, self.name, dumps(key_or_element)))
+
+    def garbage_collect(self):
+        """
+        Remove all DONE elements from queue
+        """
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM queue WHERE body = ? AND qname = ? '
+                'AND status = ?', (self.body, self.name, 'DONE'))
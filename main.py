@@ -42,7 +42,10 @@ import sys
 
 from risscraper.scraperallris import ScraperAllRis
 from risscraper.scrapersessionnet import ScraperSessionNet
+from risscraper import (fingerprint, incremental, metrics, scraperallris,
+                        scrapersessionnet)
 
+from db.export import Exporter
 import config as db_config
 
 CMD_SUBFOLDER = os.path.realpath(os.path.abspath(os.path.join(os.path.split(
@@ -52,6 +55,16 @@ if CMD_SUBFOLDER not in sys.path:
 
 
 def main():
+    options = get_parser().parse_args()
+    db = open_database(backfill=options.backfill)
+    config = db.get_config(options.body_uid)
+    db.setup(config)
+    setup_logging(config, options)
+    run(config, db, options)
+
+
+def get_parser():
+    """ Return the parser of the command line arguments """
     parser = argparse.ArgumentParser(
         description='Scrape Dein Ratsinformationssystem')
     parser.add_argument('--body', '-b', dest='body_uid', required=True,
@@ -75,6 +88,14 @@ def main():
                         help=('Find sessions and related content up to this '
                               'month. Requires --start parameter to be set, '
                               'too. Format: "YYYY-MM"'))
+    parser.add_argument('--incremental', dest="incremental",
+                        action="store_true", default=False,
+                        help=('Find sessions and related content since the '
+                              'last successful incremental run, with the '
+                              'look-back and look-ahead configured by the '
+                              'scraper options incremental_lookback_days, '
+                              'incremental_lookahead_days and '
+                              'incremental_max_lookahead_days. Implies -q.'))
     # organization
     parser.add_argument('--organizationid', dest="organization_id",
                         default=False, help='Scrape a specific organization, '
@@ -105,21 +126,66 @@ def main():
                              'detail page URL')
 
     parser.add_argument('--erase', dest="erase_db", action="store_true",
-                        default=False, help='Erase all database content '
+                        default=False, help='Erase all database content of '
+                                            'the body given by --body '
                                             'before start. Caution!')
+    parser.add_argument('--erase-all', dest="erase_all", action="store_true",
+                        default=False, help='Erase all database content of '
+                                            'all bodies before start. '
+                                            'Caution!')
+    parser.add_argument('--export', dest="export_dir", default=False,
+                        help='Export the body as OParl JSON Lines files to '
+                             'this directory instead of scraping')
+    parser.add_argument('--export-files', dest="export_files",
+                        action="store_true", default=False,
+                        help='With --export, also write the file contents '
+                             'to the subdirectory files')
+    parser.add_argument('--export-workers', dest="export_workers", type=int,
+                        default=1, help='Number of collections exported at '
+                                        'the same time')
+    parser.add_argument('--parse-workers', dest="parse_workers", type=int,
+                        default=0, help='Number of processes parsing meeting '
+                                        'and paper pages while the main '
+                                        'process fetches and stores '
+                                        '(SessionNet only)')
+    parser.add_argument('--reparse', dest="reparse", action="store_true",
+                        default=False,
+                        help='Parse the archived pages of the body again '
+                             'and save the results, without accessing the '
+                             'RIS (see the scraper option archive_pages, '
+                             'SessionNet only)')
     parser.add_argument('--status', dest="status", action="store_true",
                         default=False, help='Print out queue status')
-    options = parser.parse_args()
+    parser.add_argument('--backfill', dest="backfill", action="store_true",
+                        default=False,
+                        help='Fast mode for the initial import of a body: '
+                             'writes are not acknowledged and indexes are '
+                             'built at the end, followed by a check that '
+                             'everything was stored.')
+    return parser
+
 
-    # setup db
-    db = None
+def open_database(backfill=False):
+    """ Connect to the database configured in config.py """
     if db_config.DB_TYPE == 'mongodb':
         import db.mongodb
-        db = db.mongodb.MongoDatabase(db_config)
-        config = db.get_config(options.body_uid)
-        db.setup(config)
+        db = db.mongodb.MongoDatabase(db_config, backfill=backfill)
+    elif db_config.DB_TYPE == 'sqlite':
+        import db.sqlite
+        db = db.sqlite.SQLiteDatabase(db_config, backfill=backfill)
+    else:
+        sys.stderr.write("Unknown DB_TYPE %r in config.py\n"
+                         % db_config.DB_TYPE)
+        sys.exit(1)
+    return db
 
-    # set up logging
+
+def setup_logging(config, options):
+    """
+    Log to the log file of the body and, if asked for, to stdout. Return
+    the handlers added to the root logger, so a long running process can
+    remove them again after the run (see daemon.py).
+    """
     logfile = 'scrapearis.log'
     if config['scraper']['log_base_dir'] is not None:
         now = datetime.datetime.utcnow()
@@ -136,10 +202,14 @@ def main():
     loglevel = 'INFO'
     if config['scraper']['log_level'] is not None:
         loglevel = config['scraper']['log_level']
-    logging.basicConfig(
-        filename=logfile, level=levels[loglevel],
-        format='%(asctime)s %(name)s %(levelname)s %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S')
+    root = logging.getLogger()
+    root.setLevel(levels[loglevel])
+    fh = logging.FileHandler(logfile)
+    fh.setFormatter(logging.Formatter(
+        '%(asctime)s %(name)s %(levelname)s %(message)s',
+        '%Y-%m-%d %H:%M:%S'))
+    root.addHandler(fh)
+    handlers = [fh]
 
     # prevent "Starting new HTTP connection (1):" INFO messages from requests
     requests_log = logging.getLogger("requests")
@@ -147,26 +217,48 @@ def main():
 
     # interactive logging
     if options.interactive in levels:
-        root = logging.getLogger()
         ch = logging.StreamHandler(sys.stdout)
         ch.setLevel(levels[options.interactive])
         formatter = logging.Formatter('%(levelname)s: %(message)s')
         ch.setFormatter(formatter)
         root.addHandler(ch)
+        handlers.append(ch)
 
     logging.info('Starting scraper with configuration from "%s" and loglevel "%s"',
                  config['city']['_id'], loglevel)
+    return handlers
+
 
+def run(config, db, options):
+    """ Do what the options ask for with the body configured in config """
     # queue status
     if options.status:
         db.queue_status()
 
     # erase db
-    if options.erase_db:
+    if options.erase_all:
         print "Erasing database"
+        db.erase_all()
+    elif options.erase_db:
+        print "Erasing body %s" % config['city']['_id']
         db.erase()
 
-    if options.start_month:
+    if options.export_dir:
+        Exporter(db, options.export_dir, workers=options.export_workers,
+                 files=options.export_files).export()
+        logging.info('Export finished.')
+        return
+
+    if options.incremental:
+        # the months to scan follow from the high-water marks of the
+        # previous runs
+        run_started = datetime.datetime.utcnow()
+        options.start_month, options.end_month = incremental.scan_window(
+            config, db.load_state(), run_started)
+        logging.info("Incremental run from %s to %s",
+                     options.start_month.date(), options.end_month.date())
+        options.workfromqueue = True
+    elif options.start_month:
         try:
             options.start_month = datetime.datetime.strptime(
                 options.start_month, '%Y-%m')
@@ -193,14 +285,61 @@ def main():
             options.end_month = options.start_month
         options.workfromqueue = True
 
-    # TODO: Autodetect basic type
+    # The template system is probed once and remembered in the body
+    # document. Without a configured type, the detected one is used.
+    if options.reparse:
+        # the RIS isn't accessed, the stored fingerprint has to do
+        template = config['city'].get('templateFingerprint')
+        options.workfromqueue = False
+    else:
+        template = fingerprint.get_fingerprint(config, db)
+    if config['scraper'].get('type') in (None, 'auto'):
+        if template is None or template['type'] is None:
+            sys.stderr.write("Cannot detect the template system of %s, "
+                             "please configure scraper.type.\n"
+                             % config['scraper']['base_url'])
+            sys.exit(1)
+        config['scraper']['type'] = template['type']
+    elif template is not None and template['type'] not in (
+            None, config['scraper']['type']):
+        logging.warn("Configured scraper type %s, but %s detected",
+                     config['scraper']['type'], template['type'])
+
     if ((config['scraper']['type'] == 'sessionnet-asp')
             or (config['scraper']['type'] == 'sessionnet-php')):
         scraper = ScraperSessionNet(config, db, options)
+    elif options.reparse:
+        sys.stderr.write("--reparse is only supported for SessionNet\n")
+        sys.exit(1)
     elif config['scraper']['type'] == 'allris':
         scraper = ScraperAllRis(config, db, options)
+    else:
+        sys.stderr.write("Unknown scraper type %s\n"
+                         % config['scraper']['type'])
+        sys.exit(1)
+
+    try:
+        scrape(scraper, options)
+    except (scraperallris.TemplateError, scrapersessionnet.TemplateError):
+        # The template has probably changed, so it is probed again on the
+        # next start.
+        fingerprint.invalidate(config, db)
+        raise
+
+    db.finish()
+    if options.incremental:
+        db.save_state(incremental.update_marks(
+            db.load_state(), db.high_water, run_started))
+    metrics.log_summary()
+    logging.info('Scraper finished.')
+
 
+def scrape(scraper, options):
+    """ Scrape what the options ask for """
     scraper.guess_system()
+    if options.reparse:
+        scraper.reparse()
+        return
     # person
     if options.person_id:
         #scraper.find_person() #should be part of scraper
@@ -237,8 +376,6 @@ def main():
     if options.workfromqueue:
         scraper.work_from_queue()
 
-    logging.info('Scraper finished.')
-
 
 if __name__ == '__main__':
     main()
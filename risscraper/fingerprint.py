@@ -0,0 +1,134 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach, Ernesto Ruge
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import datetime
+import logging
+import re
+
+import requests
+
+from db.hashing import utc_naive
+
+
+# days a fingerprint is reused, see the scraper option fingerprint_ttl_days
+TTL_DAYS = 30
+
+SESSIONNET_VERSION_RE = re.compile(
+    r'SessionNet\W{0,20}(?:Version\s*)?(\d+(?:\.\d+)+)', re.IGNORECASE)
+ALLRIS_VERSION_RE = re.compile(
+    r'ALLRIS\W{0,20}(?:net\W{0,20})?(?:Version\s*)?(\d+(?:\.\d+)+)',
+    re.IGNORECASE)
+SESSIONNET_URL_RE = re.compile(r'\b(?:si|kp|to|vo)0\d\d\w*\.(asp|php)\b')
+
+
+def detect(url, body):
+    """
+    Return the fingerprint of a RIS front page with the given (final) URL
+    and HTML: a dict with the vendor, the scraper type, the version and
+    the template layout. Values which can't be told are None.
+    """
+    fingerprint = {'vendor': None, 'type': None, 'version': None,
+                   'layout': None}
+    match = SESSIONNET_URL_RE.search(url) or SESSIONNET_URL_RE.search(body)
+    if 'sessionnet' in body.lower() or (match and 'allris' not in
+                                        body.lower()):
+        fingerprint['vendor'] = 'sessionnet'
+        extension = match.group(1) if match else 'asp'
+        fingerprint['type'] = 'sessionnet-%s' % extension
+        version = SESSIONNET_VERSION_RE.search(body)
+        if version:
+            fingerprint['version'] = version.group(1)
+        # layout 3 and later use smc_* classes
+        fingerprint['layout'] = 'smc' if 'smc_' in body else 'classic'
+    elif 'allris' in body.lower():
+        fingerprint['vendor'] = 'allris'
+        fingerprint['type'] = 'allris'
+        version = ALLRIS_VERSION_RE.search(body)
+        if version:
+            fingerprint['version'] = version.group(1)
+        fingerprint['layout'] = 'xml'
+    return fingerprint
+
+
+def probe(config):
+    """ Fetch the front page of the body and return its fingerprint """
+    url = config['scraper']['base_url']
+    logging.info("Probing template system at %s", url)
+    response = requests.get(
+        url, headers={'User-agent': config['scraper']['user_agent_name']})
+    fingerprint = detect(response.url, response.text)
+    fingerprint['detected'] = datetime.datetime.utcnow()
+    return fingerprint
+
+
+def is_fresh(fingerprint, config):
+    """ Tell whether a stored fingerprint can be used without probing """
+    if not fingerprint or not fingerprint.get('type'):
+        return False
+    detected = utc_naive(fingerprint.get('detected'))
+    if detected is None:
+        return False
+    ttl = config['scraper'].get('fingerprint_ttl_days', TTL_DAYS)
+    return (datetime.datetime.utcnow() - detected
+            < datetime.timedelta(days=ttl))
+
+
+def get_fingerprint(config, db):
+    """
+    Return the template fingerprint of the body. The fingerprint stored
+    in the body document is used until it expires, then the body is
+    probed again and the new fingerprint is stored. If probing fails, an
+    expired fingerprint is better than none.
+    """
+    fingerprint = config['city'].get('templateFingerprint')
+    if is_fresh(fingerprint, config):
+        return fingerprint
+    try:
+        fingerprint = probe(config)
+    except requests.exceptions.RequestException as e:
+        logging.warn("Cannot probe template system: %s", e)
+        return fingerprint
+    logging.info("Template system: %s %s, layout %s", fingerprint['vendor'],
+                 fingerprint['version'], fingerprint['layout'])
+    db.save_fingerprint(fingerprint)
+    config['city']['templateFingerprint'] = fingerprint
+    return fingerprint
+
+
+def invalidate(config, db):
+    """ Drop the stored fingerprint, so the next run probes the body """
+    logging.info("Dropping the template fingerprint of body %s",
+                 config['city']['_id'])
+    db.save_fingerprint(None)
+    config['city'].pop('templateFingerprint', None)
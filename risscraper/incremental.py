@@ -0,0 +1,144 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach, Ernesto Ruge
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import datetime
+import logging
+
+from db.hashing import utc_naive
+
+
+# defaults of the scraper options incremental_lookback_days,
+# incremental_lookahead_days and incremental_max_lookahead_days
+LOOKBACK_DAYS = 60
+LOOKAHEAD_DAYS = 90
+MAX_LOOKAHEAD_DAYS = 365
+
+
+def scan_window(config, state, now):
+    """
+    Return the start and end (datetimes) of the meetings an incremental
+    run started at now has to look at, given the high-water marks of the
+    previous runs (see update_marks()). The window starts the look-back
+    before the last successful run, so minutes and files published late
+    are picked up, and ends the look-ahead after now or with the latest
+    meeting seen so far, whatever is later, but no more than the maximum
+    look-ahead after now. A meeting entered far in the future by mistake
+    doesn't make every run scan years of empty months.
+    """
+    lookback = datetime.timedelta(days=config['scraper'].get(
+        'incremental_lookback_days', LOOKBACK_DAYS))
+    lookahead = datetime.timedelta(days=config['scraper'].get(
+        'incremental_lookahead_days', LOOKAHEAD_DAYS))
+    max_lookahead = datetime.timedelta(days=config['scraper'].get(
+        'incremental_max_lookahead_days', MAX_LOOKAHEAD_DAYS))
+    meeting = state.get('meeting', {})
+    last_run = utc_naive(meeting.get('lastRun'))
+    if last_run is None:
+        logging.warn("No high-water marks stored yet, scanning back %d "
+                     "days only. Use --start for the initial import.",
+                     lookback.days)
+        last_run = now
+    end = now + lookahead
+    latest = utc_naive(meeting.get('latestStart'))
+    if latest is not None and latest > end:
+        end = min(latest, now + max_lookahead)
+    return last_run - lookback, end
+
+
+def stale_ids(config, db, collection, original_ids, listing=None, hot=()):
+    """
+    Return the set of original_ids whose detail pages have to be
+    fetched. If the scraper option refresh_days is set, objects whose
+    detail page has been scraped within that many days are left out.
+
+    If the scraper option hot_days is set, listing (originalId -> hash
+    of the listing row) is compared with the previous run instead:
+    only new objects, objects whose listing row changed, objects not
+    scraped within refresh_days and the hot ones are fetched.
+    """
+    refresh_days = config['scraper'].get('refresh_days')
+    max_age = None
+    if refresh_days:
+        max_age = datetime.timedelta(days=refresh_days)
+    if listing is not None and config['scraper'].get('hot_days') is not None:
+        return db.find_changed(collection, listing, max_age) | set(hot)
+    if max_age is None:
+        return set(original_ids)
+    return set(db.find_stale(collection, original_ids, max_age))
+
+
+def is_hot(config, first, last=None):
+    """
+    Tell whether the date first, or the period from first to last,
+    is within the scraper option hot_days around today. Objects in
+    this window are fetched even if their listing row is unchanged,
+    as e.g. upcoming meetings get their agenda and files.
+    """
+    hot_days = config['scraper'].get('hot_days')
+    if hot_days is None or first is None:
+        return False
+    if last is None:
+        last = first
+    if isinstance(first, datetime.datetime):
+        first = first.date()
+    if isinstance(last, datetime.datetime):
+        last = last.date()
+    window = datetime.timedelta(days=hot_days)
+    today = datetime.date.today()
+    return first - window <= today <= last + window
+
+
+def update_marks(state, high_water, started):
+    """
+    Return the high-water marks after a successful run which started at
+    started. high_water holds the highest values saved in the run (see
+    Database.note_high_water()). Per object type, the marks are the time
+    of the last successful run and the latest meeting start or the
+    highest paper originalId seen so far.
+    """
+    meeting = state.setdefault('meeting', {})
+    meeting['lastRun'] = started
+    latest = utc_naive(meeting.get('latestStart'))
+    if 'meetingStart' in high_water and (
+            latest is None or high_water['meetingStart'] > latest):
+        meeting['latestStart'] = high_water['meetingStart']
+    paper = state.setdefault('paper', {})
+    paper['lastRun'] = started
+    highest = paper.get('maxOriginalId')
+    if 'paperId' in high_water and (
+            highest is None or high_water['paperId'] > highest):
+        logging.info("New papers up to %s, previous high-water mark %s",
+                     high_water['paperId'], highest)
+        paper['maxOriginalId'] = high_water['paperId']
+    return state
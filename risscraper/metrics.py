@@ -0,0 +1,90 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach, Ernesto Ruge
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import logging
+import time
+
+
+# name -> number of events
+counters = {}
+# name -> [number of measurements, total seconds]
+timings = {}
+
+
+def reset():
+    """ Forget everything counted and measured so far """
+    counters.clear()
+    timings.clear()
+
+
+def count(name, n=1):
+    """ Add n to the counter name """
+    counters[name] = counters.get(name, 0) + n
+
+
+def add_time(name, seconds):
+    """ Add a measurement of seconds to the timing name """
+    timing = timings.get(name)
+    if timing is None:
+        timings[name] = [1, seconds]
+    else:
+        timing[0] += 1
+        timing[1] += seconds
+
+
+class Timer(object):
+    """ Context manager measuring the time of its block as timing name """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        add_time(self.name, time.time() - self.start)
+        return False
+
+
+def log_summary(limit=20):
+    """ Log all counters and the limit timings with the most total time """
+    for name in sorted(counters):
+        logging.info("Counter %s: %d", name, counters[name])
+    for name, (number, seconds) in sorted(
+            timings.iteritems(), key=lambda item: item[1][1],
+            reverse=True)[:limit]:
+        logging.info("Timing %s: %d times, %.3fs total, %.3fms each",
+                     name, number, seconds, seconds * 1000.0 / number)
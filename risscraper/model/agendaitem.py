@@ -38,6 +38,11 @@ from base import Base
 class AgendaItem(Base):
     """ An agendaitem class """
 
+    FIELDS = ('meeting', 'number', 'name', 'public', 'consultation', 'result',
+              'resolution', 'auxiliaryFile',
+              # non-oparl
+              'resolution_text', 'result_details')
+
     def __init__(self, originalId=None, body=None, originalUrl=None,
                  created=None, modified=None, keyword=None, meeting=None,
                  number=None, name=None, public=None, consultation=None,
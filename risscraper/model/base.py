@@ -35,61 +35,55 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import datetime
 
 
+class ModelType(type):
+    """
+    Metaclass of the models. The FIELDS declared by a model class become
+    its __slots__, and the fields of the class and all its bases are
+    collected once into output_keys, the (attribute, key) pairs dict()
+    returns. Attributes behind a property are declared with an x_ prefix,
+    which is removed from the key.
+    """
+
+    def __new__(mcs, name, bases, attrs):
+        if 'FIELDS' in attrs:
+            attrs['__slots__'] = tuple(attrs['FIELDS'])
+        cls = super(ModelType, mcs).__new__(mcs, name, bases, attrs)
+        fields = []
+        for klass in reversed(cls.__mro__):
+            fields.extend(klass.__dict__.get('FIELDS', ()))
+        cls.fields = tuple(fields)
+        cls.output_keys = tuple(
+            (field, field[2:] if field.startswith('x_') else field)
+            for field in fields)
+        return cls
+
+
 class Base(object):
     """
     A base object
     """
+    __metaclass__ = ModelType
+
+    FIELDS = ('originalId', 'body', 'originalUrl', 'created', 'modified',
+              'keyword', 'lastScraped')
+
+    def __new__(cls, *args, **kwargs):
+        obj = super(Base, cls).__new__(cls)
+        for field in cls.fields:
+            setattr(obj, field, None)
+        return obj
 
     def __init__(self):
-        self._filters = []
-        #{
-        #    'fieldname': 'identifier',
-        #    'filter': lambda x: filters.remove_whitespace(x)
-        #}]
-        self._required_fields = []
-        self._enforced_types = {}
-        self._defaults = {
-            'modified': datetime.datetime.utcnow(),
-            'created': datetime.datetime.utcnow(),
-        }
-        self.apply_defaults()
-        #self.apply_filters()
+        now = datetime.datetime.utcnow()
+        if self.created is None:
+            self.created = now
+        if self.modified is None:
+            self.modified = now
 
     def dict(self):
-        self.apply_filters()
         out = {}
-        for key in dir(self):
-            if key.startswith('_'):
-                continue
-            val = getattr(self, key)
-            if callable(val):
-                continue
-            if val is None:
-                continue
-            outkey = key
-            if outkey.startswith('x_'):
-                outkey = outkey[2:]
-            out[outkey] = val
+        for field, key in self.output_keys:
+            val = getattr(self, field, None)
+            if val is not None:
+                out[key] = val
         return out
-
-    def apply_defaults(self):
-        for key in self._defaults.keys():
-            if key in dir(self):
-                if getattr(self, key) is None:
-                    setattr(self, key, self._defaults[key])
-            else:
-                setattr(self, key, self._defaults[key])
-
-    def apply_filters(self):
-        for key in dir(self):
-            if key.startswith('_'):
-                continue
-            value = getattr(self, key)
-            if callable(value):
-                continue
-            if value is None:
-                continue
-            for flt in self._filters:
-                if key == flt['fieldname']:
-                    value = flt['filter'](value)
-                    setattr(self, key, value)
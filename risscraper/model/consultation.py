@@ -38,6 +38,9 @@ from base import Base
 class Consultation(Base):
     """ A consultation class """
 
+    FIELDS = ('paper', 'agendaItem', 'meeting', 'organization',
+              'authoritative', 'role', 'status')
+
     def __init__(self, body=None, originalId=None, originalUrl=None,
                  created=None, modified=None, keyword=None, paper=None,
                  agendaItem=None, meeting=None, organization=None,
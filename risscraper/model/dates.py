@@ -0,0 +1,144 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import datetime
+import re
+
+from pytz import timezone
+
+
+BERLIN = timezone('Europe/Berlin')
+
+# A number as parse's {:d} accepts it: with optional whitespace and sign.
+# SessionNet e.g. puts two spaces between date and time of meeting ends.
+NUMBER = r'\s*\+?(\d+)'
+DATE = NUMBER + r'\.' + NUMBER + r'\.' + NUMBER
+TIME = NUMBER + ':' + NUMBER
+# formats accepted by datestring_to_datetime, tried in this order
+DATE_TIME_RANGE_RE = re.compile(
+    '^' + DATE + r'\s+' + TIME + r'\s*-' + TIME + '$')
+DATE_TIME_RE = re.compile('^' + DATE + r'\s+' + TIME + '$')
+DATE_RE = re.compile('^' + DATE + '$')
+# AllRis timestamps like 20121219T160000Z
+TIMESTAMP_RE = re.compile(r'^(\d{4})(\d\d)(\d\d)T(\d\d)(\d\d)(\d\d)')
+
+# The same dates are parsed over and over again, e.g. the date of a
+# meeting for every agenda item. Results are kept until a cache holds
+# CACHE_SIZE strings.
+CACHE_SIZE = 10000
+
+
+def localize(year, month, day, hour=0, minute=0, second=0):
+    """ Return the given Berlin local time as timezone aware datetime """
+    return BERLIN.localize(
+        datetime.datetime(year, month, day, hour, minute, second))
+
+
+def cached(function):
+    """ Return function with its results cached per string """
+    cache = {}
+
+    def wrapper(string):
+        try:
+            return cache[string]
+        except KeyError:
+            pass
+        value = function(string)
+        if len(cache) >= CACHE_SIZE:
+            cache.clear()
+        cache[string] = value
+        return value
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+
+def parse_datestring(string):
+    """
+    Convert a date string like "19.12.2012", "19.12.2012 16:00" or
+    "19.12.2012 16:00-18:00" to the (start) datetime in Berlin local
+    time. Returns None for other strings.
+    """
+    string = string.strip()
+    match = (DATE_TIME_RANGE_RE.match(string)
+             or DATE_TIME_RE.match(string))
+    if match is not None:
+        day, month, year, hour, minute = [int(value)
+                                          for value in match.groups()[:5]]
+        return localize(year, month, day, hour, minute)
+    match = DATE_RE.match(string)
+    if match is not None:
+        day, month, year = [int(value) for value in match.groups()]
+        return localize(year, month, day)
+    return None
+
+
+def parse_timestamp(string):
+    """
+    Convert an AllRis timestamp like 20121219T160000Z to a datetime in
+    Berlin local time, which is what AllRis puts there despite the Z.
+    """
+    match = TIMESTAMP_RE.match(string)
+    return localize(*[int(value) for value in match.groups()])
+
+
+datestring_to_datetime = cached(parse_datestring)
+timestamp_to_datetime = cached(parse_timestamp)
+
+
+if __name__ == '__main__':
+    # microbenchmark against the former parse based implementation
+    import timeit
+
+    import parse
+
+    def parse_datestring_parse(string):
+        berlin = timezone('Europe/Berlin')
+        fmt = '{day:d}.{month:d}.{year:d} {hour:d}:{minute:d}'
+        p = parse.parse(fmt, string.strip())
+        return datetime.datetime(p['year'], p['month'], p['day'], p['hour'],
+                                 p['minute'], tzinfo=berlin)
+
+    strings = ['%d.%d.2014 %d:00' % (day, month, hour)
+               for day in range(1, 29) for month in range(1, 13)
+               for hour in (9, 17)]
+    number = 5
+    for name, function in (
+            ('parse.parse', parse_datestring_parse),
+            ('regex', parse_datestring),
+            ('regex, cached', datestring_to_datetime)):
+        seconds = min(timeit.repeat(
+            lambda: [function(string) for string in strings],
+            number=number, repeat=3))
+        print '%-14s %8.2f us per date' % (
+            name, seconds * 1000000.0 / number / len(strings))
@@ -40,6 +40,13 @@ from base import Base
 class File(Base):
     """ A file class """
 
+    FIELDS = ('fileName', 'name', 'mimeType', 'date', 'size', 'sha1Checksum',
+              'text', 'accessUrl', 'downloadUrl', 'paper', 'meeting',
+              'masterFile', 'derivativeFile', 'license', 'fileRole',
+              # non-oparl
+              'x_content', 'originalDownloadPossible', 'mimetype',
+              'filename')
+
     def __init__(self, originalId=None, body=None, originalUrl=None,
                  created=None, modified=None, keyword=None, name=None,
                  fileName=None, paper=None, mimeType=None, date=None,
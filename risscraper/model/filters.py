@@ -32,10 +32,7 @@ NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-import datetime
-
-import parse
-from pytz import timezone
+import dates
 
 
 def remove_whitespace(string):
@@ -45,30 +42,6 @@ def remove_whitespace(string):
 def datestring_to_datetime(inp):
     """ Convert a date/time string do proper start (and optionally end) datetime
     """
-    berlin = timezone('Europe/Berlin')
     if isinstance(inp, (str, unicode)):
-        string = inp.strip()
-        fmt = ('{day:d}.{month:d}.{year:d} '
-               '{hour:d}:{minute:d}-{hourend:d}:{minuteend:d}')
-        p = parse.parse(fmt, string)
-        if p is not None:
-            out = datetime.datetime(p['year'], p['month'], p['day'], p['hour'],
-                                    p['minute'], tzinfo=berlin)
-            return out
-        else:
-            fmt = '{day:d}.{month:d}.{year:d} {hour:d}:{minute:d}'
-            p = parse.parse(fmt, string)
-            if p is not None:
-                out = datetime.datetime(p['year'], p['month'], p['day'],
-                                        p['hour'], p['minute'], tzinfo=berlin)
-                return out
-            else:
-                fmt = '{day:d}.{month:d}.{year:d}'
-                p = parse.parse(fmt, string)
-                if p is not None:
-                    out = datetime.datetime(p['year'], p['month'], p['day'],
-                                            0, 0, tzinfo=berlin)
-                    return out
-                else:
-                    return None
+        return dates.datestring_to_datetime(inp)
     return inp
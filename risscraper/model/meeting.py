@@ -39,6 +39,15 @@ import filters
 class Meeting(Base):
     """ A meeting class """
 
+    FIELDS = ('name', 'x_start', 'x_end', 'room', 'streetAddress',
+              'postalCode', 'locality', 'type', 'location', 'organization',
+              'chairPerson', 'participant', 'invitation', 'scribe',
+              'invited', 'attendant', 'resultsProtocol', 'verbatimProtocol',
+              'auxiliaryFile', 'agendaItem',
+              # non-oparl
+              'shortName', 'address', 'description', 'organization_name',
+              'agendaitem')
+
     def __init__(self, originalId=None, body=None, originalUrl=None,
                  created=None, modified=None, keyword=None, name=None,
                  shortName=None, start=None, end=None, room=None,
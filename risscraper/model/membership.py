@@ -40,6 +40,10 @@ class Membership(Base):
     """
     A membership class
     """
+
+    FIELDS = ('person', 'organization', 'role', 'post', 'onBehalfOf',
+              'x_startDate', 'x_endDate')
+
     def __init__(self, originalId=None, body=None, originalUrl=None,
                  created=None, modified=None, keyword=None, person=None,
                  organization=None, role=None, post=None, onBehalfOf=None,
@@ -38,6 +38,9 @@ from base import Base
 class Organization(Base):
     """ An organisation class """
 
+    FIELDS = ('name', 'shortName', 'post', 'meeting', 'membership',
+              'classification', 'subOrganizationOf', 'startDate', 'endDate')
+
     def __init__(self, originalId=None, body=None, originalUrl=None,
                  created=None, modified=None, keyword=None, name=None,
                  shortName=None, post=None, meeting=None, membership=None,
@@ -39,6 +39,13 @@ import filters
 class Paper(Base):
     """ A paper class """
 
+    FIELDS = ('name', 'nameShort', 'reference', 'x_publishedDate',
+              'paperType', 'relatedPaper', 'mainFile', 'auxiliaryFile',
+              'location', 'originator', 'consultation', 'underDirectionOf',
+              # non-oparl
+              'superordinatedPaper', 'subordinatedPaper', 'title',
+              'description')
+
     def __init__(self, originalId=None, body=None, originalUrl=None,
                  created=None, modified=None, keyword=None, name=None,
                  nameShort=None, reference=None, publishedDate=None,
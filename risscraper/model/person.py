@@ -38,6 +38,13 @@ from base import Base
 class Person(Base):
     """ A person class """
 
+    FIELDS = ('name', 'familyName', 'givenName', 'title', 'formOfAddress',
+              'gender', 'email', 'phone', 'streetAddress', 'postalCode',
+              'locality', 'status', 'membership',
+              # non-oparl
+              'fax', 'mobile', 'website', 'firstname', 'lastname', 'sex',
+              'address', 'house_number', 'postalcode')
+
     def __init__(self, originalId=None, body=None, originalUrl=None,
                  created=None, modified=None, keyword=None, name=None,
                  familyName=None, givenName=None, title=None,
@@ -0,0 +1,71 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach, Ernesto Ruge
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import parse
+
+
+# URL template -> compiled parser, shared by all scrapers
+parsers = {}
+
+
+def compile_template(template):
+    """ Return the parse.compile'd parser of a template, built only once """
+    parser = parsers.get(template)
+    if parser is None:
+        parser = parse.compile(template)
+        parsers[template] = parser
+    return parser
+
+
+class PatternRegistry(object):
+    """
+    The URL templates of a scraper. search(name, string) works like
+    parse.search(templates[name], string) without building the regular
+    expression of the template again on every call. Compiled templates are
+    cached by the template string, so scrapers of the same type for bodies
+    with different templates each get their own.
+    """
+
+    def __init__(self, templates):
+        self.templates = templates
+        for name, template in templates.iteritems():
+            if '_PARSE_PATTERN' in name:
+                try:
+                    compile_template(template)
+                except (ValueError, TypeError):
+                    # not every URL template is a valid parse format
+                    pass
+
+    def search(self, name, string):
+        return compile_template(self.templates[name]).search(string)
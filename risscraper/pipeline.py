@@ -0,0 +1,161 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach, Ernesto Ruge
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import collections
+import copy
+import multiprocessing
+import signal
+
+
+class Page(object):
+    """
+    A fetched detail page. It can be sent to a parse worker and offers
+    read() and geturl() like the response it was read from.
+    """
+
+    def __init__(self, original_id, url, response, attempt=1):
+        self.original_id = original_id
+        self.url = url
+        self.body = response.read()
+        self.final_url = response.geturl()
+        self.attempt = attempt
+
+    def read(self):
+        return self.body
+
+    def geturl(self):
+        return self.final_url
+
+
+class ArchivedResponse(object):
+    """ A page read from the page archive, see Database.iter_pages() """
+
+    def __init__(self, stored):
+        self.body = stored['html']
+        self.final_url = stored['finalUrl']
+
+    def read(self):
+        return self.body
+
+    def geturl(self):
+        return self.final_url
+
+
+class ParseResult(object):
+    """
+    The object parsed from a page together with everything that has to be
+    fetched or written before it is stored: queue additions, file
+    downloads and unknown result strings. Being plain data, it can be
+    returned from a parse worker.
+    """
+
+    def __init__(self, collection, model):
+        self.collection = collection
+        self.model = model
+        # (queue name, key)
+        self.queued = []
+        # (file object, download form, link)
+        self.downloads = []
+        # (agenda item, result string)
+        self.result_strings = []
+        # the page was broken and has to be fetched again
+        self.retry = False
+
+    def queue(self, name, key):
+        self.queued.append((name, key))
+
+    def download(self, file_obj, form=None, link=None):
+        self.downloads.append((file_obj, form, link))
+
+    def result_string(self, agendaitem, value):
+        self.result_strings.append((agendaitem, value))
+
+
+# the scraper parsing pages in a worker process
+worker_scraper = None
+
+
+def init_worker(scraper_class, config, options):
+    global worker_scraper
+    # interrupts are handled by the main process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_scraper = scraper_class(config, None, options)
+    worker_scraper.guess_system()
+
+
+def parse(method, page):
+    return getattr(worker_scraper, method)(page)
+
+
+class ParsePool(object):
+    """
+    Parses pages of a scraper in worker processes, so parsing uses all
+    cores while the main process keeps fetching and storing.
+
+    submit() hands a page to a parse method of the scraper, e.g.
+    'parse_meeting', and calls callback with the ParseResult in the main
+    process. Results are handled in the order the pages were submitted.
+    At most two pages per worker are parsed or waiting at the same time.
+    """
+
+    def __init__(self, scraper, workers):
+        options = copy.copy(scraper.options)
+        # workers don't access queues or the database
+        options.workfromqueue = False
+        self.pool = multiprocessing.Pool(
+            workers, init_worker, (scraper.__class__, scraper.config,
+                                   options))
+        self.pending = collections.deque()
+        self.limit = 2 * workers
+
+    def submit(self, method, page, callback):
+        self.pending.append(
+            (self.pool.apply_async(parse, (method, page)), callback))
+        while len(self.pending) > self.limit:
+            self.complete()
+
+    def complete(self):
+        """ Wait for the oldest page and handle its result """
+        async_result, callback = self.pending.popleft()
+        callback(async_result.get())
+
+    def drain(self):
+        """ Handle the results of all pages submitted so far """
+        while self.pending:
+            self.complete()
+
+    def close(self):
+        self.drain()
+        self.pool.close()
+        self.pool.join()
@@ -33,7 +33,9 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 import datetime
+from hashlib import sha1
 import HTMLParser
+import itertools
 import logging
 import re
 import sys
@@ -43,7 +45,6 @@ from lxml import etree, html
 from lxml.cssselect import CSSSelector
 import magic
 import mechanize
-from pytz import timezone
 import requests
 
 from model.person import Person
@@ -54,15 +55,30 @@ from model.consultation import Consultation
 from model.paper import Paper
 from model.agendaitem import AgendaItem
 from model.file import File
-import queue
+from model import dates
+import incremental
+import metrics
 
 
 class ScraperAllRis(object):
 
     # find everything inside a body of a subdocument
     body_re = re.compile("<?xml .*<body[ ]*>(.*)</body>")
+    # AllRis sometimes leaves out the < of a tag, e.g. 'td class="x">'
+    # right after another tag. Only places between table rows and cells
+    # are repaired, where a table can't contain text, so cell texts like
+    # 'p>' stay as they are.
+    missing_lt_re = re.compile(
+        r'((?:</(?:td|th|tr|thead|tbody)|<(?:table|thead|tbody|tr)'
+        r'(?:\s[^<>]*)?)>\s*)'
+        r'(/?(?:a|b|br|div|font|form|img|input|p|span|table|tbody|td|'
+        r'th|thead|tr)(?:\s+[\w-]+=(?:"[^"]*"|\'[^\']*\'|[^\s<>]+))*/?>)',
+        re.IGNORECASE)
     # marker for no date being found
     TIME_MARKER = datetime.datetime(1903, 1, 1)
+    # default of the scraper option listing_batch_size: rows of a listing
+    # page which are parsed, checked and queued together
+    LISTING_BATCH_SIZE = 500
 
     """
     adoption_css = CSSSelector("#rismain table.risdeco tbody tr td table.tk1 "
@@ -96,13 +112,15 @@ class ScraperAllRis(object):
         self.user_agent.addheaders = [('User-agent', config['scraper']['user_agent_name'])]
         # Queues
         if self.options.workfromqueue:
-            self.person_queue = queue.Queue('ALLRIS_PERSON', config, db)
-            self.meeting_queue = queue.Queue('ALLRIS_MEETING', config, db)
-            self.paper_queue = queue.Queue('ALLRIS_PAPER', config, db)
+            self.person_queue = db.get_queue('ALLRIS_PERSON')
+            self.meeting_queue = db.get_queue('ALLRIS_MEETING')
+            self.paper_queue = db.get_queue('ALLRIS_PAPER')
         # system info (PHP/ASP)
         self.template_system = None
         self.urls = None
         self.xpath = None
+        self.listing_batch_size = config['scraper'].get(
+            'listing_batch_size', self.LISTING_BATCH_SIZE)
 
         self.user_agent = mechanize.Browser()
         self.user_agent.set_handle_robots(False)
@@ -138,10 +156,11 @@ class ScraperAllRis(object):
         """
         Tries to find out which AllRis version we are working with
         and adapts configuration
-        TODO: XML Guess
         """
         self.template_system = 'xml'
-        logging.info("Nothing to guess until now.")
+        template = self.config['city'].get('templateFingerprint') or {}
+        logging.info("AllRis version %s, layout %s",
+                     template.get('version'), template.get('layout'))
 
     def find_person(self):
         find_person_url = (self.config['scraper']['base_url'] +
@@ -152,25 +171,32 @@ class ScraperAllRis(object):
                            'searchForm=true&search=Suchen')
         logging.info("Getting person overview from %s", find_person_url)
 
-        """parse an XML file and return the tree"""
-        parser = etree.XMLParser(recover=True)
-        r = self.get_url(find_person_url)
+        r = self.get_url(find_person_url, stream=True)
         if not r:
             return
-        xml = r.text.encode('ascii', 'xmlcharrefreplace')
-        tree = etree.fromstring(xml, parser=parser)
-        h = HTMLParser.HTMLParser()
+        persons = self.iter_persons(r)
+        while True:
+            batch = list(itertools.islice(persons,
+                                          self.listing_batch_size))
+            if not batch:
+                break
+            stale = incremental.stale_ids(
+                self.config, self.db, 'person',
+                [person.originalId for person, linked in batch if linked])
+            for person, linked in batch:
+                if (hasattr(self, 'person_queue')
+                        and person.originalId in stale):
+                    self.person_queue.add(person.originalId)
+                self.db.save_person(person)
 
+    def iter_persons(self, response):
+        """
+        Yield (person, linked) for every person of a person list response.
+        """
         # element 0 is the special block
         # element 1 is the list of persons
-        for node in tree[1].iterchildren():
-            elem = {}
-            for e in node.iterchildren():
-                if e.text:
-                    elem[e.tag] = h.unescape(e.text)
-                else:
-                    elem[e.tag] = ''
-
+        for elem in self.iter_list_items(
+                response, lambda index, element: index == 1):
             # now retrieve person details such as organization memberships etc.
             # we also get the age (but only that, no date of birth)
             person = Person(originalId=int(elem['kplfdnr']))
@@ -224,13 +250,11 @@ class ScraperAllRis(object):
                 person.membership = [Membership(originalId=original_id,
                                                 organization=new_organization)]
 
-            if elem['link_kp'] is not None:
-                if hasattr(self, 'person_queue'):
-                    self.person_queue.add(person.originalId)
-            else:
+            linked = elem['link_kp'] is not None
+            if not linked:
                 logging.info("Person %s %s has no link", person.firstname,
                              person.lastname)
-            self.db.save_person(person)
+            yield person, linked
 
     def find_meeting(self, start_date=None, end_date=None):
         """ Find meetings within a given time frame and add them to the meeting
@@ -242,27 +266,34 @@ class ScraperAllRis(object):
                                end_date.strftime("%d.%m.%Y")))
         logging.info("Getting meeting overview from %s", meeting_find_url)
 
-        parser = etree.XMLParser(recover=True)
-        h = HTMLParser.HTMLParser()
-
-        r = self.get_url(meeting_find_url)
+        r = self.get_url(meeting_find_url, stream=True)
         if not r:
             return
-
-        xml = r.text.encode('ascii', 'xmlcharrefreplace').replace('</a>', '')
-        xml = re.sub(r'<a href="([^"]*)" target="_blank" ?>', r'\1', xml)
-        root = etree.fromstring(xml, parser=parser)
-        for item in root:
-            if item.tag == 'list':
-                root = item
+        meetings = self.iter_meetings(r)
+        while True:
+            batch = list(itertools.islice(meetings,
+                                          self.listing_batch_size))
+            if not batch:
                 break
-        for item in root.iterchildren():
-            raw_meeting = {}
-            for e in item.iterchildren():
-                if e.text:
-                    raw_meeting[e.tag] = h.unescape(e.text)
-                else:
-                    raw_meeting[e.tag] = ''
+            listing = dict((meeting.originalId, row_hash)
+                           for meeting, row_hash in batch)
+            hot = [meeting.originalId for meeting, row_hash in batch
+                   if incremental.is_hot(self.config, meeting.start,
+                                         meeting.end)]
+            stale = incremental.stale_ids(self.config, self.db, 'meeting',
+                                          listing.keys(), listing, hot)
+            for meeting, row_hash in batch:
+                self.db.save_meeting(meeting)
+                if meeting.originalId in stale:
+                    self.meeting_queue.add(meeting.originalId)
+
+    def iter_meetings(self, response):
+        """
+        Yield (meeting, hash of its list item) for every meeting of a
+        meeting list response.
+        """
+        for raw_meeting in self.iter_list_items(
+                response, lambda index, element: element.tag == 'list'):
             meeting = Meeting(originalId=int(raw_meeting['silfdnr']))
             meeting.start = self.parse_date(raw_meeting['sisbvcs'])
             meeting.end = self.parse_date(raw_meeting['sisevcs'])
@@ -273,8 +304,61 @@ class ScraperAllRis(object):
             meeting.name = raw_meeting['sitext']
             meeting.organization_name = raw_meeting['grname']
             # meeting.description = raw_meeting['sitext'] # WHAT TO DO WITH THIS
-            self.db.save_meeting(meeting)
-            self.meeting_queue.add(meeting.originalId)
+            row = u'\n'.join(u'%s=%s' % field
+                             for field in sorted(raw_meeting.iteritems()))
+            yield meeting, sha1(row.encode('utf-8')).hexdigest()
+
+    def iter_list_items(self, response, is_list):
+        """
+        Parse an AllRis XML list response while it is downloaded and yield
+        a dict of field name -> unescaped text for every item of the list.
+        is_list(index, element) tells whether a child of the root element
+        is the list. Processed elements are cleared, so the memory used
+        does not grow with the length of the list.
+        """
+        h = HTMLParser.HTMLParser()
+        response.raw.decode_content = True
+        # the encoding of the HTTP header wins, like for response.text
+        encoding = requests.utils.get_encoding_from_headers(response.headers)
+        events = etree.iterparse(response.raw, events=('start', 'end'),
+                                 encoding=encoding, recover=True)
+        depth = 0
+        index = -1
+        in_list = False
+        for event, element in events:
+            if event == 'start':
+                depth += 1
+                if depth == 2:
+                    index += 1
+                    in_list = is_list(index, element)
+                continue
+            if depth == 3 and in_list:
+                item = {}
+                for field in element.iterchildren():
+                    text = self.element_text(field)
+                    if text:
+                        item[field.tag] = h.unescape(text)
+                    else:
+                        item[field.tag] = ''
+                yield item
+            if depth <= 3:
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            depth -= 1
+
+    def element_text(self, element):
+        """
+        Return the text of an element. Links are replaced by their target
+        followed by their text, as some lists wrap values into links.
+        """
+        parts = [element.text or '']
+        for child in element.iterchildren():
+            if child.tag == 'a':
+                parts.append(child.get('href', ''))
+            parts.append(self.element_text(child))
+            parts.append(child.tail or '')
+        return ''.join(parts)
 
     def get_organization(self, organization_id=None, organization_url=None):
         pass
@@ -288,15 +372,15 @@ class ScraperAllRis(object):
                % (self.config['scraper']['base_url'], person_id))
 
         logging.info("Getting person organization from %s", url)
-        # Stupid re-try concept because AllRis sometimes misses start < at
-        # tags at first request.
+        # AllRis sometimes misses start < at tags. This is repaired, the
+        # page is only fetched again if the repair didn't help.
         try_counter = 0
         while True:
             try:
                 response = self.get_url(url)
-                if not url:
+                if not response:
                     return
-                tree = html.fromstring(response.text)
+                tree = html.fromstring(self.repair_markup(response.text))
 
                 memberships = []
                 person = Person(originalId=person_id)
@@ -428,6 +512,7 @@ class ScraperAllRis(object):
                                 logging.warn("Bad organization at %s", url)
 
                     person.membership = memberships
+                    person.lastScraped = datetime.datetime.utcnow()
                     oid = self.db.save_person(person)
                     return
                 else:
@@ -437,6 +522,7 @@ class ScraperAllRis(object):
                 if try_counter < 3:
                     logging.info("Try again: Getting person organizations with "
                                  "person id %d from %s", person_id, url)
+                    metrics.count('allris refetches')
                     try_counter += 1
                 else:
                     logging.error("Failed getting person organizations with "
@@ -577,6 +663,7 @@ class ScraperAllRis(object):
                     agendaitem.result = add_agenda_item['totyp']
                 agendaitems.append(agendaitem)
         meeting.agendaItem = agendaitems
+        meeting.lastScraped = datetime.datetime.utcnow()
 
         oid = self.db.save_meeting(meeting)
         logging.info("Meeting %d stored with _id %s", meeting_id, oid)
@@ -591,8 +678,8 @@ class ScraperAllRis(object):
                      % (self.config['scraper']['base_url'], paper_id))
         logging.info("Getting paper %d from %s", paper_id, paper_url)
 
-        # Stupid re-try concept because AllRis sometimes misses
-        # start < at tags at first request.
+        # AllRis sometimes misses start < at tags. This is repaired, the
+        # page is only fetched again if the repair didn't help.
         try_counter = 0
         while True:
             try:
@@ -603,7 +690,7 @@ class ScraperAllRis(object):
                     logging.warn("Paper %s in %s seems to private",
                                  paper_id, paper_url)
                     return
-                text = response.text
+                text = self.repair_markup(response.text)
                 doc = html.fromstring(text)
                 data = {}
 
@@ -792,7 +879,7 @@ class ScraperAllRis(object):
                     # actually).
                 # The actual text comes after the table in a div but it's not
                 # valid XML or HTML this using regex.
-                data['docs'] = self.body_re.findall(response.text)
+                data['docs'] = self.body_re.findall(text)
                 first_date = False
                 for single_date in date_list:
                     if first_date:
@@ -843,19 +930,31 @@ class ScraperAllRis(object):
                                 paper.auxiliaryFile.append(aux_file)
                 print paper.auxiliaryFile
                 if not len(paper.auxiliaryFile):
-                    del paper.auxiliaryFile
+                    paper.auxiliaryFile = None
+                paper.lastScraped = datetime.datetime.utcnow()
                 oid = self.db.save_paper(paper)
                 return
             except (KeyError, IndexError):
                 if try_counter < 3:
                     logging.info("Try again: Getting paper %d from %s",
                                  paper_id, paper_url)
+                    metrics.count('allris refetches')
                     try_counter += 1
                 else:
                     logging.error("Failed getting paper %d from %s",
                                   paper_id, paper_url)
                     return
 
+    def repair_markup(self, text):
+        """
+        Add the < AllRis sometimes leaves out at tags. Repairs are counted
+        in metrics.
+        """
+        text, repairs = self.missing_lt_re.subn(r'\1<\2', text)
+        if repairs:
+            metrics.count('allris markup repairs', repairs)
+        return text
+
     def get_file(self, file_obj, file_url, post=False):
         """
         Loads the file file from the server and stores it into
@@ -908,15 +1007,15 @@ class ScraperAllRis(object):
                          "file id %s", file_obj.mimetype, file_obj.originalId)
         return name + '.' + ext
 
-    def get_url(self, url, post_data=None):
+    def get_url(self, url, post_data=None, stream=False):
         retry_counter = 0
         while retry_counter < 4:
             retry = False
             try:
                 if post_data is not None:
-                    response = requests.post(url, post_data)
+                    response = requests.post(url, post_data, stream=stream)
                 else:
-                    response = requests.get(url)
+                    response = requests.get(url, stream=stream)
                 return response
             except requests.exceptions.ConnectionError:
                 retry_counter += 1
@@ -933,15 +1032,7 @@ class ScraperAllRis(object):
     # mrtopf
     def parse_date(self, s):
         """parse dates like 20121219T160000Z"""
-        berlin = timezone('Europe/Berlin')
-        year = int(s[0:4])
-        month = int(s[4:6])
-        day = int(s[6:8])
-        hour = int(s[9:11])
-        minute = int(s[11:13])
-        second = int(s[13:15])
-        return datetime.datetime(year, month, day, hour, minute, second, 0,
-                                 tzinfo=berlin)
+        return dates.timestamp_to_datetime(s)
 
 
 class TemplateError(Exception):
@@ -32,16 +32,20 @@ NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+import datetime
+from hashlib import sha1
 import logging
+import multiprocessing
 from StringIO import StringIO
 import time
 import sys
+import urllib
 import urllib2
+import urlparse
 
 from lxml import etree
 import magic
 import mechanize
-import parse
 
 from model.person import Person
 from model.membership import Membership
@@ -51,11 +55,21 @@ from model.consultation import Consultation
 from model.paper import Paper
 from model.agendaitem import AgendaItem
 from model.file import File
-import queue
+import incremental
+import patterns
+import pipeline
+import xpaths
 
 
 class ScraperSessionNet(object):
 
+    # archived page kind -> parse method, without "parse_"
+    PARSE_METHODS = {
+        'person': 'person_organization',
+        'meeting': 'meeting',
+        'paper': 'paper',
+    }
+
     def __init__(self, config, db, options):
         # configuration
         self.config = config
@@ -70,13 +84,15 @@ class ScraperSessionNet(object):
                                        config['scraper']['user_agent_name'])]
         # Queues
         if self.options.workfromqueue:
-            self.person_queue = queue.Queue('SESSIONNET_PERSON', config, db)
-            self.meeting_queue = queue.Queue('SESSIONNET_MEETING', config, db)
-            self.paper_queue = queue.Queue('SESSIONNET_PAPER', config, db)
+            self.person_queue = db.get_queue('SESSIONNET_PERSON')
+            self.meeting_queue = db.get_queue('SESSIONNET_MEETING')
+            self.paper_queue = db.get_queue('SESSIONNET_PAPER')
         # system info (PHP/ASP)
         self.template_system = None
         self.urls = None
         self.xpath = None
+        self.selectors = None
+        self.patterns = None
 
     def work_from_queue(self):
         """
@@ -91,20 +107,68 @@ class ScraperSessionNet(object):
             #self.get_person(committee_id=job['key'])
             self.get_person_organization(person_id=job['key'])
             self.person_queue.resolve_job(job)
+        # meeting and paper pages are parsed by worker processes if
+        # --parse-workers is given
+        pool = None
+        if self.options.parse_workers:
+            pool = pipeline.ParsePool(self, self.options.parse_workers)
         while self.meeting_queue.has_next():
             job = self.meeting_queue.get()
-            self.get_meeting(meeting_id=job['key'])
-            self.meeting_queue.resolve_job(job)
+            if pool is None:
+                self.get_meeting(meeting_id=job['key'])
+                self.meeting_queue.resolve_job(job)
+            else:
+                self.submit_meeting(pool, job)
+        if pool is not None:
+            # meetings add papers to the queue
+            pool.drain()
         while self.paper_queue.has_next():
             job = self.paper_queue.get()
-            self.get_paper(paper_id=job['key'])
-            self.paper_queue.resolve_job(job)
+            if pool is None:
+                self.get_paper(paper_id=job['key'])
+                self.paper_queue.resolve_job(job)
+            else:
+                self.submit_paper(pool, job)
+        if pool is not None:
+            pool.close()
 
         # when everything is done, we remove DONE jobs
         self.person_queue.garbage_collect()
         self.meeting_queue.garbage_collect()
         self.paper_queue.garbage_collect()
 
+    def submit_meeting(self, pool, job):
+        """ Fetch the meeting of a queue job and parse it in the pool """
+        page = self.fetch_meeting(meeting_id=job['key'])
+        if page is None:
+            self.meeting_queue.resolve_job(job)
+            return
+
+        def parsed(result):
+            if result is not None:
+                self.store_result(result)
+            self.meeting_queue.resolve_job(job)
+        pool.submit('parse_meeting', page, parsed)
+
+    def submit_paper(self, pool, job, attempt=1):
+        """ Fetch the paper of a queue job and parse it in the pool """
+        page = self.fetch_paper(paper_id=job['key'], attempt=attempt)
+        if page is None:
+            self.paper_queue.resolve_job(job)
+            return
+
+        def parsed(result):
+            if result is not None and result.retry:
+                if page.attempt < 4:
+                    self.submit_paper(pool, job, page.attempt + 1)
+                    return
+                logging.error("Permanent error in %s after %d retrys.",
+                              page.url, page.attempt)
+            elif result is not None:
+                self.store_result(result)
+            self.paper_queue.resolve_job(job)
+        pool.submit('parse_paper', page, parsed)
+
     def guess_system(self):
         """
         Tries to find out which SessionNet version we are working with
@@ -135,7 +199,18 @@ class ScraperSessionNet(object):
         #    sys.exit(1)
         scraper_type = self.config['scraper']['type']
         self.urls = self.config['scraper'][scraper_type]['urls']
+        self.patterns = patterns.PatternRegistry(self.urls)
         self.xpath = self.config['scraper'][scraper_type]['xpath']
+        # the fingerprint tells the template layout, which may come with
+        # its own expressions in config['scraper'][type]['layouts']
+        template = self.config['city'].get('templateFingerprint') or {}
+        layouts = self.config['scraper'][scraper_type].get('layouts', {})
+        if template.get('layout') in layouts:
+            logging.info("Using expressions for SessionNet layout %s",
+                         template['layout'])
+            self.xpath = dict(self.xpath)
+            self.xpath.update(layouts[template['layout']].get('xpath', {}))
+        self.selectors = xpaths.get_registry(scraper_type, self.xpath)
 
 
     def find_person(self):
@@ -158,22 +233,22 @@ class ScraperSessionNet(object):
         parser = etree.HTMLParser()
         dom = etree.parse(StringIO(html), parser)
 
-        trs = dom.xpath(self.xpath['PERSONLIST_LINES'])
+        persons = []
+        trs = self.selectors(dom, self.xpath['PERSONLIST_LINES'])
         for tr in trs:
             current_person = None
-            link = tr.xpath('.//a')
+            link = self.selectors(tr, './/a')
             if len(link):
-                parsed = parse.search(self.urls['PERSON_DETAIL_PARSE_PATTERN'],
-                                      link[0].get('href'))
+                parsed = self.patterns.search(
+                    'PERSON_DETAIL_PARSE_PATTERN', link[0].get('href'))
                 if not parsed:
-                    parsed = parse.search(
-                        self.urls['PERSON_DETAIL_PARSE_PATTERN_ALT'],
-                        link[0].get('href'))
+                    parsed = self.patterns.search(
+                        'PERSON_DETAIL_PARSE_PATTERN_ALT', link[0].get('href'))
                 if parsed:
                     person_id = parsed['person_id']
                     current_person = Person(originalId=person_id)
             if current_person:
-                tds = tr.xpath('.//td')
+                tds = self.selectors(tr, './/td')
                 if len(tds):
                     if len(tds[0]):
                         person_name = tds[0][0].text.strip()
@@ -196,9 +271,14 @@ class ScraperSessionNet(object):
                             organization=new_organization)
                         current_person.membership = [new_membership]
                 if current_person:
-                    if hasattr(self, 'person_queue'):
-                        self.person_queue.add(current_person.originalId)
-                    self.db.save_person(current_person)
+                    persons.append(current_person)
+        stale = incremental.stale_ids(
+            self.config, self.db, 'person',
+            [person.originalId for person in persons])
+        for person in persons:
+            if hasattr(self, 'person_queue') and person.originalId in stale:
+                self.person_queue.add(person.originalId)
+            self.db.save_person(person)
         return
 
     """
@@ -211,8 +291,8 @@ class ScraperSessionNet(object):
             person_url = (self.urls['COMMITTEE_DETAIL_PRINT_PATTERN_FULL']
                           % person_id)
         elif person_url is not None:
-            parsed = parse.search(
-                self.urls['COMMITTEE_DETAIL_PARSE_PATTERN_FULL'], person_url)
+            parsed = self.patterns.search(
+                'COMMITTEE_DETAIL_PARSE_PATTERN_FULL', person_url)
             person_id = parsed['person_id']
 
         logging.info("Getting meeting (committee) %d from %s",
@@ -232,9 +312,9 @@ class ScraperSessionNet(object):
         parser = etree.HTMLParser()
         dom = etree.parse(StringIO(html), parser)
 
-        trs = dom.xpath(self.xpath['COMMITTEE_LINES'])
+        trs = self.selectors(dom, self.xpath['COMMITTEE_LINES'])
         for tr in trs:
-            tds = tr.xpath('.//td')
+            tds = self.selectors(tr, './/td')
             print tds
             if tr.get('class') == 'smcrowh':
                 print tds[0].text
@@ -248,54 +328,77 @@ class ScraperSessionNet(object):
                                 person_id=None):
         """ Load committee details for the given detail page URL or numeric ID
         """
+        page = self.fetch_person_organization(
+            person_organization_url=person_organization_url,
+            person_id=person_id)
+        if page is None:
+            return
+        self.store_result(self.parse_person_organization(page))
+
+    def fetch_person_organization(self, person_organization_url=None,
+                                  person_id=None):
+        """
+        Fetch the organization list of a person and return it as
+        pipeline.Page
+        """
         # Read either committee_id or committee_url from the opposite
         if person_id is not None:
             person_committee_url = (self.urls['PERSON_ORGANIZATION_PRINT_PATTERN']
                                     % (self.config['scraper']['base_url'],
                                        person_id))
         elif person_organization_url is not None:
-            parsed = parse.search(self.urls['PERSON_ORGANIZATION_PRINT_PATTERN'],
-                                  person_organization_url)
+            person_committee_url = person_organization_url
+            parsed = self.patterns.search(
+                'PERSON_ORGANIZATION_PRINT_PATTERN', person_organization_url)
             person_id = parsed['person_id']
 
         logging.info("Getting person %d organizations from %s",
                      person_id, person_committee_url)
 
-        person = Person(originalId=person_id)
-
         time.sleep(self.config['scraper']['wait_time'])
         response = self.get_url(person_committee_url)
         if not response:
             return
+        page = pipeline.Page(person_id, person_committee_url, response)
+        self.archive_page('person', page)
+        return page
 
-        # seek(0) is necessary to reset response pointer.
-        response.seek(0)
-        html = response.read()
+    def parse_person_organization(self, page):
+        """
+        Parse the organization list of a person. Returns a
+        pipeline.ParseResult with the person and its memberships. This
+        doesn't access the network or the database.
+        """
+        person_id = page.original_id
+        person_committee_url = page.url
+        person = Person(originalId=person_id)
+        result = pipeline.ParseResult('person', person)
+
+        html = page.read()
         html = html.replace('&nbsp;', ' ')
         parser = etree.HTMLParser()
         dom = etree.parse(StringIO(html), parser)
 
-        trs = dom.xpath(self.xpath['PERSON_ORGANIZATION_LINES'])
+        trs = self.selectors(dom, self.xpath['PERSON_ORGANIZATION_LINES'])
         memberships = []
         for tr in trs:
-            tds = tr.xpath('.//td')
+            tds = self.selectors(tr, './/td')
             long_info = False
             if len(tds) == 5:
                 long_info = True
             if len(tds) == 5 or len(tds) == 2:
-                if tds[0].xpath('.//a'):
+                if self.selectors(tds[0], './/a'):
                     href = tds[0][0].get('href')
                     href_tmp = href.split('&')
                     # delete __cgrname when it's there
                     if len(href_tmp) == 2:
                         if href_tmp[1][0:10] == '__cgrname=':
                             href = href_tmp[0]
-                    parsed = parse.search(
-                        self.urls['ORGANIZATION_DETAIL_PARSE_PATTERN'], href)
+                    parsed = self.patterns.search(
+                        'ORGANIZATION_DETAIL_PARSE_PATTERN', href)
                     if not parsed:
-                        parsed = parse.search(
-                            self.urls['ORGANIZATION_DETAIL_PARSE_PATTERN_FULL'],
-                            href)
+                        parsed = self.patterns.search(
+                            'ORGANIZATION_DETAIL_PARSE_PATTERN_FULL', href)
                     if parsed is not None:
                         original_id = int(parsed['committee_id'])
                         new_organisation = Organization(originalId=original_id)
@@ -324,9 +427,7 @@ class ScraperSessionNet(object):
                                       person_committee_url)
         if memberships:
             person.membership = memberships
-        oid = self.db.save_person(person)
-        logging.info("Person %d stored with _id %s", person_id, oid)
-        return
+        return result
 
     def get_person_committee_presence(self, person_id=None, person_url=None):
         # URL is like ???
@@ -356,16 +457,34 @@ class ScraperSessionNet(object):
             html = html.replace('&nbsp;', ' ')
             parser = etree.HTMLParser()
             dom = etree.parse(StringIO(html), parser)
-            found = 0
-            for link in dom.xpath('//a'):
+            meeting_ids = []
+            # meeting id -> hash of its calendar row
+            listing = {}
+            for link in self.selectors(dom, '//a'):
                 href = link.get('href')
                 if href is None:
                     continue
-                parsed = parse.search(self.urls['MEETING_DETAIL_PARSE_PATTERN'],
-                                      href)
+                parsed = self.patterns.search(
+                    'MEETING_DETAIL_PARSE_PATTERN', href)
                 if hasattr(self, 'meeting_queue') and parsed is not None:
-                    self.meeting_queue.add(int(parsed['meeting_id']))
-                    found += 1
+                    meeting_id = int(parsed['meeting_id'])
+                    meeting_ids.append(meeting_id)
+                    row = next(link.iterancestors('tr'), link)
+                    listing[meeting_id] = sha1(etree.tostring(
+                        row, method='text', encoding='utf-8')).hexdigest()
+            # the calendar doesn't tell the dates, the month has to do
+            first = datetime.date(year, month, 1)
+            last = ((first + datetime.timedelta(days=31)).replace(day=1)
+                    - datetime.timedelta(days=1))
+            hot = ()
+            if incremental.is_hot(self.config, first, last):
+                hot = meeting_ids
+            stale = incremental.stale_ids(self.config, self.db, 'meeting',
+                                          meeting_ids, listing, hot)
+            for meeting_id in meeting_ids:
+                if meeting_id in stale:
+                    self.meeting_queue.add(meeting_id)
+            found = len(meeting_ids)
             if found == 0:
                 logging.info("No meetings(sessions) found for month %04d-%02d",
                              year, month)
@@ -374,37 +493,53 @@ class ScraperSessionNet(object):
     def get_meeting(self, meeting_url=None, meeting_id=None):
         """ Load meeting details for the given detail page URL or numeric ID
         """
+        page = self.fetch_meeting(meeting_url=meeting_url,
+                                  meeting_id=meeting_id)
+        if page is None:
+            return
+        result = self.parse_meeting(page)
+        if result is not None:
+            self.store_result(result)
+
+    def fetch_meeting(self, meeting_url=None, meeting_id=None):
+        """ Fetch the meeting detail page and return it as pipeline.Page """
         # Read either meeting_id or meeting_url from the opposite
         if meeting_id is not None:
             meeting_url = (self.urls['MEETING_DETAIL_PRINT_PATTERN']
                            % (self.config["scraper"]["base_url"], meeting_id))
         elif meeting_url is not None:
-            parsed = parse.search(self.urls['MEETING_DETAIL_PARSE_PATTERN'],
-                                  meeting_url)
+            parsed = self.patterns.search(
+                'MEETING_DETAIL_PARSE_PATTERN', meeting_url)
             meeting_id = parsed['meeting_id']
 
         logging.info("Getting meeting (session) %d from %s",
                      meeting_id, meeting_url)
 
-        meeting = Meeting(originalId=meeting_id)
-
         time.sleep(self.config['scraper']['wait_time'])
         response = self.get_url(meeting_url)
         if not response:
             return
+        page = pipeline.Page(meeting_id, meeting_url, response)
+        self.archive_page('meeting', page)
+        return page
 
+    def parse_meeting(self, page):
+        """
+        Parse a meeting detail page. Returns a pipeline.ParseResult, or None
+        if the page does not contain a meeting. This doesn't access the
+        network or the database, so it can run in a parse worker.
+        """
+        meeting_id = page.original_id
+        meeting_url = page.url
+        meeting = Meeting(originalId=meeting_id)
+        result = pipeline.ParseResult('meeting', meeting)
+
+        dom = self.parse_page(page)
         # forms for later document download
-        mechanize_forms = mechanize.ParseResponse(response,
-                                                  backwards_compat=False)
-        # seek(0) is necessary to reset response pointer.
-        response.seek(0)
-        html = response.read()
-        html = html.replace('&nbsp;', ' ')
-        parser = etree.HTMLParser()
-        dom = etree.parse(StringIO(html), parser)
+        download_forms = self.download_forms(dom, page.geturl())
         # check for page errors
         try:
-            page_title = dom.xpath('//h1')[0].text
+            page_title = self.text(self.selectors(dom, '//h1')[0])
             if 'Fehlermeldung' in page_title:
                 logging.info("Page %s cannot be accessed due to server error",
                              meeting_url)
@@ -416,7 +551,8 @@ class ScraperSessionNet(object):
         except:
             pass
         try:
-            error_h3 = dom.xpath('//h3[@class="smc_h3"]')[0].text.strip()
+            error_h3 = self.text(self.selectors(
+                dom, '//h3[@class="smc_h3"]')[0]).strip()
             if 'Keine Daten gefunden' in error_h3:
                 logging.info("Page %s does not contain any agenda items",
                              meeting_url)
@@ -431,7 +567,8 @@ class ScraperSessionNet(object):
         meeting.originalUrl = meeting_url
         # Session title
         try:
-            meeting.name = dom.xpath(self.xpath['MEETING_DETAIL_TITLE'])[0].text
+            meeting.name = self.text(self.selectors(
+                dom, self.xpath['MEETING_DETAIL_TITLE'])[0])
         except:
             logging.critical('Cannot find session title element using XPath '
                              'MEETING_DETAIL_TITLE')
@@ -457,7 +594,7 @@ class ScraperSessionNet(object):
         #                        'using MEETING_DETAIL_COMMITTEE_LINK_XPATH')
 
         # Meeting identifier, date, address etc
-        tds = dom.xpath(self.xpath['MEETING_DETAIL_IDENTIFIER_TD'])
+        tds = self.selectors(dom, self.xpath['MEETING_DETAIL_IDENTIFIER_TD'])
         if len(tds) == 0:
             logging.critical('Cannot find table fields using '
                              'MEETING_DETAIL_IDENTIFIER_TD_XPATH at session %s',
@@ -468,8 +605,8 @@ class ScraperSessionNet(object):
         else:
             for n in range(0, len(tds)):
                 try:
-                    tdcontent = tds[n].text.strip()
-                    nextcontent = tds[n + 1].text.strip()
+                    tdcontent = self.text(tds[n]).strip()
+                    nextcontent = self.text(tds[n + 1]).strip()
                 except:
                     continue
                 if tdcontent == 'Sitzung:':
@@ -481,9 +618,9 @@ class ScraperSessionNet(object):
                 elif tdcontent == 'Datum:':
                     start = nextcontent
                     end = nextcontent
-                    if tds[n + 2].text == 'Zeit:':
-                        if tds[n + 3].text is not None:
-                            times = tds[n + 3].text.replace(
+                    if self.text(tds[n + 2]) == 'Zeit:':
+                        if self.text(tds[n + 3]) is not None:
+                            times = self.text(tds[n + 3]).replace(
                                 ' Uhr', '').split('-')
                             start = start + ' ' + times[0]
                             if len(times) > 1:
@@ -493,7 +630,8 @@ class ScraperSessionNet(object):
                         meeting.start = start
                         meeting.end = end
                 elif tdcontent == 'Raum:':
-                    meeting.address = " ".join(tds[n + 1].xpath('./text()'))
+                    meeting.address = " ".join(
+                        self.texts(tds[n + 1], './text()'))
                 elif tdcontent == 'Bezeichnung:':
                     meeting.description = nextcontent
                 # sense?
@@ -505,12 +643,13 @@ class ScraperSessionNet(object):
 
         # Agendaitems
         found_files = []
-        rows = dom.xpath(self.xpath['MEETING_DETAIL_AGENDAITEM_ROWS'])
+        rows = self.selectors(dom,
+                              self.xpath['MEETING_DETAIL_AGENDAITEM_ROWS'])
         if len(rows) == 0:
-            no_agendaitem_check = dom.xpath('//h5')
+            no_agendaitem_check = self.selectors(dom, '//h5')
             no_agendaitem = False
             for item in no_agendaitem_check:
-                if item.text.strip() == 'Keine Daten gefunden.':
+                if self.text(item).strip() == 'Keine Daten gefunden.':
                     no_agendaitem = True
             if no_agendaitem:
                 logging.warn("Meeting without agendaitems found in %s",
@@ -530,13 +669,13 @@ class ScraperSessionNet(object):
             for row in rows:
                 row_id = row.get('id')
                 row_classes = row.get('class').split(' ')
-                fields = row.xpath('td')
-                number = fields[0].xpath('./text()')
+                fields = self.selectors(row, 'td')
+                number = self.texts(fields[0], './text()')
                 if len(number) > 0:
                     number = number[0]
                 else:
                     # when theres a updated notice theres an additional spam
-                    number = fields[0].xpath('.//span/text()')
+                    number = self.texts(fields[0], './/span/text()')
                     if len(number) > 0:
                         number = number[0]
                 if number == []:
@@ -551,17 +690,20 @@ class ScraperSessionNet(object):
                     if number is not None:
                         agendaitem.number = number
                     # in some ris this is a link, sometimes not. test both.
-                    if len(fields[1].xpath('./a/text()')):
-                        agendaitem.name = "; ".join(fields[1].xpath('./a/text()'))
-                    elif len(fields[1].xpath('./text()')):
-                        agendaitem.name = "; ".join(fields[1].xpath('./text()'))
+                    if len(self.texts(fields[1], './a/text()')):
+                        agendaitem.name = "; ".join(
+                            self.texts(fields[1], './a/text()'))
+                    elif len(self.texts(fields[1], './text()')):
+                        agendaitem.name = "; ".join(
+                            self.texts(fields[1], './text()'))
                     # ignore no agendaitem information
                     if agendaitem.name == 'keine Tagesordnungspunkte':
                         agendaitem = None
                         continue
                     agendaitem.public = public
                     # paper links
-                    links = row.xpath(
+                    links = self.selectors(
+                        row,
                         self.xpath['MEETING_DETAIL_AGENDAITEM_ROWS_PAPER_LINK'])
                     consultations = []
                     for link in links:
@@ -569,8 +711,8 @@ class ScraperSessionNet(object):
                         if href is None:
                             continue
                         # links to papers
-                        parsed = parse.search(
-                            self.urls['PAPER_DETAIL_PARSE_PATTERN'], href)
+                        parsed = self.patterns.search(
+                            'PAPER_DETAIL_PARSE_PATTERN', href)
                         if parsed is not None:
                             original_id = (unicode(agendaitem.originalId)
                                            + unicode(parsed['paper_id']))
@@ -582,8 +724,7 @@ class ScraperSessionNet(object):
                                 originalId=int(parsed['paper_id']))
                             consultations.append(consultation)
                             # Add paper to paper queue
-                            if hasattr(self, 'paper_queue'):
-                                self.paper_queue.add(int(parsed['paper_id']))
+                            result.queue('paper', int(parsed['paper_id']))
                     if len(consultations) == 1:
                         agendaitem.consultation = consultations[0]
                     elif len(consultations) > 1:
@@ -597,17 +738,18 @@ class ScraperSessionNet(object):
                     in found_files
                     """
                     # find links
-                    links = row.xpath('.//a[contains(@href,"getfile.")]')
+                    links = self.selectors(
+                        row, './/a[contains(@href,"getfile.")]')
                     for link in links:
-                        if not link.xpath('.//img'):
+                        if not self.selectors(link, './/img'):
                             file_link = (self.config['scraper']['base_url']
                                          + link.get('href'))
                             file_id = file_link.split('id=')[1].split('&')[0]
                             found_files.append(file_id)
                     # find forms
-                    forms = row.xpath('.//form')
+                    forms = self.selectors(row, './/form')
                     for form in forms:
-                        for hidden_field in form.xpath('input'):
+                        for hidden_field in self.selectors(form, 'input'):
                             if hidden_field.get('name') != 'DT':
                                 continue
                             file_id = hidden_field.get('value')
@@ -617,8 +759,8 @@ class ScraperSessionNet(object):
                       or ((row.get('valign') == 'top')
                           and (row.get('debug') == '3'))):
                     # additional (optional row for agendaitem)
-                    label = fields[1].text
-                    value = fields[2].text
+                    label = self.text(fields[1])
+                    value = self.text(fields[2])
                     if label is not None and value is not None:
                         label = label.strip()
                         value = value.strip()
@@ -630,12 +772,13 @@ class ScraperSessionNet(object):
                                 if result_string[0] == value:
                                     new_result_string = result_string[1]
                                     break
-                            if not new_result_string:
-                                new_result_string = self.db.save_result_string(value)
+                            if new_result_string:
+                                agendaitem.result = new_result_string
+                            else:
+                                result.result_string(agendaitem, value)
                                 logging.warn("String '%s' not found in "
                                              "configured RESULT_STRINGS",
                                              value)
-                            agendaitem.result = new_result_string
                         elif label in ['Bemerkung:', 'Abstimmung:']:
                             agendaitem.result_details = value
                         # What's this?
@@ -648,14 +791,14 @@ class ScraperSessionNet(object):
                                              "is unknown" % label)
                 elif 'smcrowh' in row_classes:
                     # Subheading (public / nonpublic part)
-                    text = fields[0].text
+                    text = self.text(fields[0])
                     if ((text is not None)
                             and ("Nicht öffentlich" in text.encode('utf-8'))):
                         public = False
             meeting.agendaItem = agendaitems
 
         # meeting-related documents
-        containers = dom.xpath(self.xpath['MEETING_DETAIL_FILES'])
+        containers = self.selectors(dom, self.xpath['MEETING_DETAIL_FILES'])
         for container in containers:
             classes = container.get('class')
             if classes is None:
@@ -668,14 +811,15 @@ class ScraperSessionNet(object):
             resultsProtocol = None
             verbatimProtocol = None
             auxiliaryFile = []
-            rows = container.xpath('.//tr')
+            rows = self.selectors(container, './/tr')
             for row in rows:
-                if not row.xpath('.//form'):
-                    links = row.xpath('.//a')
+                if not self.selectors(row, './/form'):
+                    links = self.selectors(row, './/a')
                     for link in links:
                         # ignore additional pdf icon links
-                        if not link.xpath('.//img'):
-                            name = ' '.join(link.xpath('./text()')).strip()
+                        if not self.selectors(link, './/img'):
+                            name = ' '.join(
+                                self.texts(link, './text()')).strip()
                             file_link = (self.config['scraper']['base_url']
                                          + link.get('href'))
                             file_id = file_link.split('id=')[1].split('&')[0]
@@ -686,8 +830,7 @@ class ScraperSessionNet(object):
                                 name=name,
                                 originalUrl=file_link,
                                 originalDownloadPossible=True)
-                            file_obj = self.get_file(file_obj,
-                                                     link=file_link)
+                            result.download(file_obj, link=file_link)
                             if 'Einladung' in name:
                                 invitations.append(file_obj)
                             elif 'Niederschrift' in name:
@@ -700,10 +843,11 @@ class ScraperSessionNet(object):
                                 auxiliaryFile.append(file_obj)
                             found_files.append(file_id)
                 else:
-                    forms = row.xpath('.//form')
+                    forms = self.selectors(row, './/form')
                     for form in forms:
-                        name = " ".join(row.xpath('./td/text()')).strip()
-                        for hidden_field in form.xpath('input'):
+                        name = " ".join(
+                            self.texts(row, './td/text()')).strip()
+                        for hidden_field in self.selectors(form, 'input'):
                             if hidden_field.get('name') != 'DT':
                                 continue
                             file_id = hidden_field.get('value')
@@ -715,14 +859,10 @@ class ScraperSessionNet(object):
                                     name=name,
                                     originalDownloadPossible=False
                                 )
-                                # Traversing the whole mechanize response
-                                # to submit this form.
-                                for mform in mechanize_forms:
-                                    for control in mform.controls:
-                                        if ((control.name == 'DT')
-                                                and (control.value == file_id)):
-                                            file_obj = self.get_file(file_obj,
-                                                                     mform)
+                                if file_id in download_forms:
+                                    result.download(
+                                        file_obj,
+                                        form=download_forms[file_id])
                                 if 'Einladung' in name:
                                     invitations.append(file)
                                 elif 'Niederschrift' in name:
@@ -742,8 +882,7 @@ class ScraperSessionNet(object):
                 meeting.verbatimProtocol = verbatimProtocol
             if auxiliaryFile:
                 meeting.auxiliaryFile = auxiliaryFile
-        oid = self.db.save_meeting(meeting)
-        logging.info("Meeting %d stored with _id %s", meeting_id, oid)
+        return result
 
 
     def get_paper(self, paper_url=None, paper_id=None):
@@ -751,28 +890,38 @@ class ScraperSessionNet(object):
         Load paper details for the paper given by detail page URL
         or numeric ID
         """
+        for attempt in range(1, 5):
+            page = self.fetch_paper(paper_url=paper_url, paper_id=paper_id,
+                                    attempt=attempt)
+            if page is None:
+                return
+            result = self.parse_paper(page)
+            if result is None:
+                return
+            if not result.retry:
+                self.store_result(result)
+                return
+        logging.error("Permanent error in %s after %d retrys.",
+                      page.url, attempt)
+
+    def fetch_paper(self, paper_url=None, paper_id=None, attempt=1):
+        """ Fetch the paper detail page and return it as pipeline.Page """
         # Read either paper_id or paper_url from the opposite
         if paper_id is not None:
             paper_url = (self.urls['PAPER_DETAIL_PRINT_PATTERN']
                          % (self.config["scraper"]["base_url"], paper_id))
         elif paper_url is not None:
-            parsed = parse.search(self.urls['PAPER_DETAIL_PARSE_PATTERN'],
-                                  paper_url)
+            parsed = self.patterns.search(
+                'PAPER_DETAIL_PARSE_PATTERN', paper_url)
             paper_id = parsed['paper_id']
 
         logging.info("Getting paper %d from %s", paper_id, paper_url)
 
-        paper = Paper(originalId=paper_id)
-        try_until = 1
-        try_counter = 0
-        try_found = False
-
-        while try_counter < try_until:
-            try_counter += 1
-            try_found = False
+        for try_counter in range(1, 5):
             time.sleep(self.config['scraper']['wait_time'])
             try:
                 response = self.user_agent.open(paper_url)
+                break
             except urllib2.HTTPError, e:
                 if e.code == 404:
                     sys.stderr.write("URL not found (HTTP 404) error "
@@ -780,255 +929,394 @@ class ScraperSessionNet(object):
                     sys.stderr.write("Please check BASE_URL in your "
                                      "configuration.\n")
                     sys.exit(1)
-                elif e.code in (500, 502):
-                    try_until = 4
-                    try_found = True
-                    if try_until == try_counter:
-                        logging.error("Permanent error in %s after %d retrys.",
-                                      paper_url, try_counter)
-                        return
-                    else:
-                        logging.info("Original RIS Server Bug, restart "
-                                     "fetching paper %s", paper_url)
-            if not response:
+                elif e.code not in (500, 502):
+                    raise
+                logging.info("Original RIS Server Bug, restart fetching "
+                             "paper %s", paper_url)
+        else:
+            logging.error("Permanent error in %s after %d retrys.",
+                          paper_url, try_counter)
+            return
+        page = pipeline.Page(paper_id, paper_url, response, attempt)
+        self.archive_page('paper', page)
+        return page
+
+    def parse_paper(self, page):
+        """
+        Parse a paper detail page. Returns a pipeline.ParseResult, or None
+        if the page does not contain a paper. If the page is broken, retry
+        of the result is set. This doesn't access the network or the
+        database, so it can run in a parse worker.
+        """
+        paper_id = page.original_id
+        paper_url = page.url
+        paper = Paper(originalId=paper_id)
+        result = pipeline.ParseResult('paper', paper)
+
+        dom = self.parse_page(page)
+        download_forms = self.download_forms(dom, page.geturl())
+        # Hole die Seite noch einmal wenn unbekannter zufällig
+        # auftretender Fehler ohne Fehlermeldung ausgegeben wird
+        # (gefunden in Duisburg, vermutlich kaputte Server Config).
+        try:
+            page_title = self.text(self.selectors(dom, '//h1')[0])
+            if 'Fehler' in page_title:
+                logging.info("Original RIS Server Bug, restart scraping "
+                             "paper %s", paper_url)
+                result.retry = True
+                return result
+        except:
+            pass
+        # check for page errors
+        try:
+            if 'Fehlermeldung' in page_title:
+                logging.info("Page %s cannot be accessed due to "
+                             "server error", paper_url)
                 return
-            mechanize_forms = mechanize.ParseResponse(response,
-                                                      backwards_compat=False)
-            response.seek(0)
-            html = response.read()
-            html = html.replace('&nbsp;', ' ')
-            parser = etree.HTMLParser()
-            dom = etree.parse(StringIO(html), parser)
-            # Hole die Seite noch einmal wenn unbekannter zufällig
-            # auftretender Fehler ohne Fehlermeldung ausgegeben wird
-            # (gefunden in Duisburg, vermutlich kaputte Server Config).
-            try:
-                page_title = dom.xpath('//h1')[0].text
-                if 'Fehler' in page_title:
-                    try_until = 4
-                    try_found = True
-                    if try_until == try_counter:
-                        logging.error("Permanent error in %s after %d retrys, "
-                                      "proceed.", paper_url, try_counter)
-                    else:
-                        logging.info("Original RIS Server Bug, restart "
-                                     "scraping paper %s", paper_url)
-            except:
-                pass
-            if not try_found:
-                # check for page errors
-                try:
-                    if 'Fehlermeldung' in page_title:
-                        logging.info("Page %s cannot be accessed due to "
-                                     "server error", paper_url)
-                        return
-                    if 'Berechtigungsfehler' in page_title:
-                        logging.info("Page %s cannot be accessed due to "
-                                     "permissions", paper_url)
-                        return
-                except:
-                    pass
+            if 'Berechtigungsfehler' in page_title:
+                logging.info("Page %s cannot be accessed due to "
+                             "permissions", paper_url)
+                return
+        except:
+            pass
 
-                paper.originalUrl = paper_url
-                superordinated_papers = []
-                subordinated_papers = []
+        paper.originalUrl = paper_url
+        superordinated_papers = []
+        subordinated_papers = []
 
-                # Paper title
+        # Paper title
+        try:
+            stitle = self.selectors(dom,
+                                    self.xpath['PAPER_DETAIL_TITLE'])
+            paper.title = self.text(stitle[0])
+        except:
+            logging.critical('Cannot find paper title element using '
+                             'XPath PAPER_DETAIL_TITLE')
+            raise TemplateError('Cannot find paper title element '
+                                'using XPath PAPER_DETAIL_TITLE')
+
+        # Paper identifier, date, type etc
+        tds = self.selectors(
+            dom, self.xpath['PAPER_DETAIL_IDENTIFIER_TD'])
+        if len(tds) == 0:
+            logging.critical('Cannot find table fields using XPath '
+                             'PAPER_DETAIL_IDENTIFIER_TD')
+            logging.critical('HTML Dump: %s', page.read())
+            raise TemplateError('Cannot find table fields using XPath '
+                                'PAPER_DETAIL_IDENTIFIER_TD')
+        else:
+            current_category = None
+            for n in range(0, len(tds)):
                 try:
-                    stitle = dom.xpath(self.xpath['PAPER_DETAIL_TITLE'])
-                    paper.title = stitle[0].text
+                    tdcontent = self.text(tds[n]).strip()
                 except:
-                    logging.critical('Cannot find paper title element using '
-                                     'XPath PAPER_DETAIL_TITLE')
-                    raise TemplateError('Cannot find paper title element '
-                                        'using XPath PAPER_DETAIL_TITLE')
-
-                # Paper identifier, date, type etc
-                tds = dom.xpath(self.xpath['PAPER_DETAIL_IDENTIFIER_TD'])
-                if len(tds) == 0:
-                    logging.critical('Cannot find table fields using XPath '
-                                     'PAPER_DETAIL_IDENTIFIER_TD')
-                    logging.critical('HTML Dump: %s', html)
-                    raise TemplateError('Cannot find table fields using XPath '
-                                        'PAPER_DETAIL_IDENTIFIER_TD')
+                    continue
+                if tdcontent == 'Name:':
+                    paper.nameShort = self.text(tds[n + 1]).strip()
+                # TODO: Dereferenzierung von Paper Type Strings
+                elif tdcontent == 'Art:':
+                    paper.paperType = self.text(tds[n + 1]).strip()
+                elif tdcontent == 'Datum:':
+                    paper.publishedDate = self.text(tds[n + 1]).strip()
+                elif tdcontent == 'Betreff:':
+                    paper.name = '; '.join(
+                        self.texts(tds[n + 1], './text()'))
+                elif tdcontent == 'Aktenzeichen:':
+                    paper.reference = self.text(tds[n + 1]).strip()
+                elif tdcontent == 'Referenzvorlage:':
+                    link = self.selectors(tds[n + 1], 'a')[0]
+                    href = link.get('href')
+                    parsed = self.patterns.search(
+                        'PAPER_DETAIL_PARSE_PATTERN', href)
+                    superordinated_paper = Paper(
+                        originalId=parsed['paper_id'],
+                        nameShort=self.text(link).strip())
+                    superordinated_papers.append(superordinated_paper)
+                    # add superordinate paper to queue
+                    result.queue('paper', parsed['paper_id'])
+                # subordinate papers are added to the queue
+                elif tdcontent == 'Untergeordnete Vorlage(n):':
+                    current_category = 'subordinates'
+                    for link in self.selectors(tds[n + 1], 'a'):
+                        href = link.get('href')
+                        parsed = self.patterns.search(
+                            'PAPER_DETAIL_PARSE_PATTERN', href)
+                        subordinated_paper = Paper(
+                            originalId=parsed['paper_id'],
+                            nameShort=self.text(link).strip())
+                        subordinated_papers.append(subordinated_paper)
+                        if parsed is not None:
+                            # add subordinate paper to queue
+                            result.queue('paper', parsed['paper_id'])
+                elif tdcontent == u'Anträge zur Vorlage:':
+                    current_category = 'todo'
                 else:
-                    current_category = None
-                    for n in range(0, len(tds)):
-                        try:
-                            tdcontent = tds[n].text.strip()
-                        except:
-                            continue
-                        if tdcontent == 'Name:':
-                            paper.nameShort = tds[n + 1].text.strip()
-                        # TODO: Dereferenzierung von Paper Type Strings
-                        elif tdcontent == 'Art:':
-                            paper.paperType = tds[n + 1].text.strip()
-                        elif tdcontent == 'Datum:':
-                            paper.publishedDate = tds[n + 1].text.strip()
-                        elif tdcontent == 'Betreff:':
-                            paper.name = '; '.join(tds[n + 1].xpath('./text()'))
-                        elif tdcontent == 'Aktenzeichen:':
-                            paper.reference = tds[n + 1].text.strip()
-                        elif tdcontent == 'Referenzvorlage:':
-                            link = tds[n + 1].xpath('a')[0]
+                    if ((current_category == 'subordinates')
+                            and (len(tds) > n + 1)):
+                        for link in self.selectors(tds[n + 1], 'a'):
                             href = link.get('href')
-                            parsed = parse.search(
-                                self.urls['PAPER_DETAIL_PARSE_PATTERN'], href)
-                            superordinated_paper = Paper(
+                            parsed = self.patterns.search(
+                                'PAPER_DETAIL_PARSE_PATTERN', href)
+                            subordinated_paper = Paper(
                                 originalId=parsed['paper_id'],
-                                nameShort=link.text.strip())
-                            superordinated_papers.append(superordinated_paper)
-                            # add superordinate paper to queue
-                            if hasattr(self, 'paper_queue'):
-                                self.paper_queue.add(parsed['paper_id'])
-                        # subordinate papers are added to the queue
-                        elif tdcontent == 'Untergeordnete Vorlage(n):':
-                            current_category = 'subordinates'
-                            for link in tds[n + 1].xpath('a'):
-                                href = link.get('href')
-                                parsed = parse.search(
-                                    self.urls['PAPER_DETAIL_PARSE_PATTERN'],
-                                    href)
-                                subordinated_paper = Paper(
-                                    originalId=parsed['paper_id'],
-                                    nameShort=link.text.strip())
-                                subordinated_papers.append(subordinated_paper)
-                                if (hasattr(self, 'paper_queue')
-                                        and parsed is not None):
-                                    # add subordinate paper to queue
-                                    self.paper_queue.add(parsed['paper_id'])
-                        elif tdcontent == u'Anträge zur Vorlage:':
-                            current_category = 'todo'
-                        else:
-                            if ((current_category == 'subordinates')
-                                    and (len(tds) > n + 1)):
-                                for link in tds[n + 1].xpath('a'):
-                                    href = link.get('href')
-                                    parsed = parse.search(
-                                        self.urls['PAPER_DETAIL_PARSE_PATTERN'],
-                                        href)
-                                    subordinated_paper = Paper(
-                                        originalId=parsed['paper_id'],
-                                        nameShort=link.text.strip())
-                                    subordinated_papers.append(
-                                        subordinated_paper)
-                                    if (hasattr(self, 'paper_queue')
-                                            and parsed is not None):
-                                        self.paper_queue.add(parsed['paper_id'])
-                    if subordinated_papers:
-                        paper.subordinatedPaper = subordinated_papers
-                    if superordinated_papers:
-                        paper.superordinatedPaper = superordinated_papers
-                    if not hasattr(paper, 'originalId'):
-                        logging.critical('Cannot find paper identifier using '
-                                         'MEETING_DETAIL_IDENTIFIER_TD')
-                        raise TemplateError(
-                            'Cannot find paper identifier using '
-                            'MEETING_DETAIL_IDENTIFIER_TD')
-
-                # "Beratungsfolge"(list of sessions for this paper)
-                # This is currently not parsed for scraping, but only for
-                # gathering session-document ids for later exclusion
-                # Already changed: found_files, files. todo: document_foo
-                found_files = []
-                rows = dom.xpath(self.xpath['PAPER_DETAIL_AGENDA_ROWS'])
-                for row in rows:
-                    # find forms
-                    formfields = row.xpath('.//input[@type="hidden"]'
-                                           '[@name="DT"]')
-                    for formfield in formfields:
-                        file_id = formfield.get('value')
-                        if file_id is not None:
-                            found_files.append(file_id)
-                    # find links
-                    links = row.xpath('.//a[contains(@href,"getfile.")]')
+                                nameShort=self.text(link).strip())
+                            subordinated_papers.append(
+                                subordinated_paper)
+                            if parsed is not None:
+                                result.queue('paper', parsed['paper_id'])
+            if subordinated_papers:
+                paper.subordinatedPaper = subordinated_papers
+            if superordinated_papers:
+                paper.superordinatedPaper = superordinated_papers
+            if not hasattr(paper, 'originalId'):
+                logging.critical('Cannot find paper identifier using '
+                                 'MEETING_DETAIL_IDENTIFIER_TD')
+                raise TemplateError(
+                    'Cannot find paper identifier using '
+                    'MEETING_DETAIL_IDENTIFIER_TD')
+
+        # "Beratungsfolge"(list of sessions for this paper)
+        # This is currently not parsed for scraping, but only for
+        # gathering session-document ids for later exclusion
+        # Already changed: found_files, files. todo: document_foo
+        found_files = []
+        rows = self.selectors(
+            dom, self.xpath['PAPER_DETAIL_AGENDA_ROWS'])
+        for row in rows:
+            # find forms
+            formfields = self.selectors(row, './/input[@type="hidden"]'
+                                   '[@name="DT"]')
+            for formfield in formfields:
+                file_id = formfield.get('value')
+                if file_id is not None:
+                    found_files.append(file_id)
+            # find links
+            links = self.selectors(
+                row, './/a[contains(@href,"getfile.")]')
+            for link in links:
+                if not self.selectors(link, './/img'):
+                    file_link = (self.config['scraper']['base_url']
+                                 + link.get('href'))
+                    file_id = file_link.split('id=')[1].split('&')[0]
+                    found_files.append(file_id)
+        # paper-related documents
+        files = []
+        containers = self.selectors(
+            dom, self.xpath['PAPER_DETAIL_FILES'])
+        for container in containers:
+            try:
+                classes = container.get('class').split(' ')
+            except:
+                continue
+            if (self.xpath['PAPER_DETAIL_FILES_CONTAINER_CLASSNAME']
+                    not in classes):
+                continue
+            rows = self.selectors(container, './/tr')
+            for row in rows:
+                # seems that we have direct links
+                if not self.selectors(row, './/form'):
+                    links = self.selectors(row, './/a')
                     for link in links:
-                        if not link.xpath('.//img'):
-                            file_link = (self.config['scraper']['base_url']
-                                         + link.get('href'))
-                            file_id = file_link.split('id=')[1].split('&')[0]
+                        # ignore additional pdf icon links
+                        if not self.selectors(link, './/img'):
+                            name = ' '.join(self.texts(
+                                link, './text()')).strip()
+                            file_link = self.config['scraper'][
+                                'base_url'] + link.get('href')
+                            file_id = file_link.split('id=')[1].split(
+                                '&')[0]
+                            if file_id in found_files:
+                                continue
+                            file_obj = File(
+                                originalId=file_id,
+                                name=name,
+                                originalUrl=file_link,
+                                originalDownloadPossible=True)
+                            result.download(file_obj, link=file_link)
+                            files.append(file_obj)
                             found_files.append(file_id)
-                # paper-related documents
-                files = []
-                containers = dom.xpath(self.xpath['PAPER_DETAIL_FILES'])
-                for container in containers:
-                    try:
-                        classes = container.get('class').split(' ')
-                    except:
+
+                # no direct link, so we have to handle forms
+                else:
+                    forms = self.selectors(row, './/form')
+                    for form in forms:
+                        name = " ".join(self.texts(
+                            row, './td/text()')).strip()
+                        for hidden_field in self.selectors(
+                                form, 'input[@name="DT"]'):
+                            file_id = hidden_field.get('value')
+                            if file_id in found_files:
+                                continue
+                            file_obj = File(
+                                originalId=file_id,
+                                name=name,
+                                originalDownloadPossible=False)
+                            if file_id in download_forms:
+                                result.download(
+                                    file_obj,
+                                    form=download_forms[file_id])
+                                files.append(file_obj)
+                                found_files.append(file_id)
+        if files:
+            paper.mainFile = files[0]
+        if len(files) > 1:
+            paper.auxiliaryFile = files[1:]
+        return result
+
+    def store_result(self, result, fetch_files=True, scraped=True):
+        """
+        Store a pipeline.ParseResult: add the queued keys to their queues,
+        download the files, save unknown result strings and then save the
+        parsed object. Without fetch_files, stored files keep their
+        current content. Unless scraped is False, the object is marked as
+        scraped from its detail page right now (lastScraped).
+        """
+        for name, key in result.queued:
+            if hasattr(self, name + '_queue'):
+                getattr(self, name + '_queue').add(key)
+        if fetch_files:
+            for file_obj, form, link in result.downloads:
+                self.get_file(file_obj, form=form, link=link)
+        for agendaitem, value in result.result_strings:
+            agendaitem.result = self.db.save_result_string(value)
+        if scraped:
+            result.model.lastScraped = datetime.datetime.utcnow()
+        oid = getattr(self.db, 'save_' + result.collection)(result.model)
+        logging.info("%s %s stored with _id %s",
+                     result.collection.capitalize(),
+                     result.model.originalId, oid)
+
+    def archive_page(self, kind, page):
+        """ Keep a fetched page if the scraper option archive_pages is set """
+        if self.config['scraper'].get('archive_pages'):
+            self.db.archive_page(kind, page)
+
+    def reparse(self):
+        """
+        Parse the archived person, meeting and paper pages again (see
+        archive_page()) and save the results, using all cores unless
+        --parse-workers says otherwise. The RIS is not accessed: nothing
+        is queued and files are not downloaded again.
+        """
+        workers = self.options.parse_workers or multiprocessing.cpu_count()
+        pool = pipeline.ParsePool(self, workers)
+        for kind in ['person', 'meeting', 'paper']:
+            logging.info("Parsing archived %s pages", kind)
+            for stored in self.db.load_pages(kind):
+                page = pipeline.Page(stored['originalId'], stored['url'],
+                                     pipeline.ArchivedResponse(stored))
+                pool.submit('parse_' + self.PARSE_METHODS[kind], page,
+                            self.reparsed)
+            # persons before their meetings, meetings before their papers
+            pool.drain()
+        pool.close()
+
+    def reparsed(self, result):
+        if result is None:
+            return
+        if result.retry:
+            logging.warn("Archived %s %s is broken, it has to be scraped "
+                         "again", result.collection, result.model.originalId)
+            return
+        # the RIS hasn't been asked, so lastScraped stays as it is
+        self.store_result(result, fetch_files=False, scraped=False)
+
+    def parse_page(self, response):
+        """
+        Parse an HTML response into an lxml tree. Texts have to be read
+        with text() or texts(), which turn non-breaking spaces into plain
+        spaces.
+        """
+        return etree.fromstring(response.read(),
+                                etree.HTMLParser()).getroottree()
+
+    def text(self, element):
+        """
+        Return the text of an element with non-breaking spaces as plain
+        spaces, as cell texts are compared with plain strings.
+        """
+        return self.plain_spaces(element.text)
+
+    def texts(self, node, expression):
+        """ Return the texts selected by an XPath expression, like text() """
+        return [self.plain_spaces(text)
+                for text in self.selectors(node, expression)]
+
+    def plain_spaces(self, text):
+        if text is None or u'\xa0' not in text:
+            return text
+        text = text.replace(u'\xa0', u' ')
+        try:
+            # like lxml, return ASCII texts as str
+            return str(text)
+        except UnicodeEncodeError:
+            return text
+
+    def download_forms(self, dom, url):
+        """
+        Return the file download forms of a parsed page, by the value of
+        their DT field, as dicts with the url, method and data a browser
+        would submit. This replaces a second parse of the page by
+        mechanize.ParseResponse().
+        """
+        encoding = dom.docinfo.encoding or 'utf-8'
+
+        def encode(value):
+            if isinstance(value, unicode):
+                return value.encode(encoding)
+            return value
+
+        forms = {}
+        for form in self.selectors(dom, '//form[.//input[@name="DT"]]'):
+            data = []
+            clicked = False
+            for field in self.selectors(form, './/input[@name]'):
+                field_type = (field.get('type') or 'text').lower()
+                name = encode(field.get('name'))
+                value = encode(field.get('value') or '')
+                if field_type in ('submit', 'image'):
+                    # the form is submitted by its first button
+                    if clicked:
                         continue
-                    if (self.xpath['PAPER_DETAIL_FILES_CONTAINER_CLASSNAME']
-                            not in classes):
+                    clicked = True
+                    if field_type == 'image':
+                        data += [(name + '.x', '1'), (name + '.y', '1')]
                         continue
-                    rows = container.xpath('.//tr')
-                    for row in rows:
-                        # seems that we have direct links
-                        if not row.xpath('.//form'):
-                            links = row.xpath('.//a')
-                            for link in links:
-                                # ignore additional pdf icon links
-                                if not link.xpath('.//img'):
-                                    name = ' '.join(link.xpath(
-                                        './text()')).strip()
-                                    file_link = self.config['scraper'][
-                                        'base_url'] + link.get('href')
-                                    file_id = file_link.split('id=')[1].split(
-                                        '&')[0]
-                                    if file_id in found_files:
-                                        continue
-                                    file_obj = File(
-                                        originalId=file_id,
-                                        name=name,
-                                        originalUrl=file_link,
-                                        originalDownloadPossible=True)
-                                    file_obj = self.get_file(file_obj,
-                                                             link=file_link)
-                                    files.append(file_obj)
-                                    found_files.append(file_id)
-
-                        # no direct link, so we have to handle forms
-                        else:
-                            forms = row.xpath('.//form')
-                            for form in forms:
-                                name = " ".join(row.xpath(
-                                    './td/text()')).strip()
-                                for hidden_field in form.xpath(
-                                        'input[@name="DT"]'):
-                                    file_id = hidden_field.get('value')
-                                    if file_id in found_files:
-                                        continue
-                                    file_obj = File(
-                                        originalId=file_id,
-                                        name=name,
-                                        originalDownloadPossible=False)
-                                    # Traversing the whole mechanize response
-                                    # to submit this form.
-                                    for mform in mechanize_forms:
-                                        for control in mform.controls:
-                                            if ((control.name == 'DT') and
-                                                    (control.value == file_id)):
-                                                file_obj = self.get_file(
-                                                    file_obj, form=mform)
-                                                files.append(file_obj)
-                                                found_files.append(file_id)
-                if files:
-                    paper.mainFile = files[0]
-                if len(files) > 1:
-                    paper.auxiliaryFile = files[1:]
-                oid = self.db.save_paper(paper)
+                elif field_type in ('checkbox', 'radio'):
+                    if field.get('checked') is None:
+                        continue
+                elif field_type in ('button', 'reset', 'file'):
+                    continue
+                data.append((name, value))
+            file_id = self.selectors(
+                form, './/input[@name="DT"]')[0].get('value')
+            forms[file_id] = {
+                'url': urlparse.urljoin(url, form.get('action') or ''),
+                'method': (form.get('method') or 'GET').upper(),
+                'data': data
+            }
+        return forms
+
+    def form_request(self, form):
+        """ Return the request submitting a form from download_forms() """
+        data = urllib.urlencode(form['data'])
+        if form['method'] == 'POST':
+            return mechanize.Request(form['url'], data)
+        return mechanize.Request('%s?%s' % (form['url'].split('?')[0], data))
 
     def get_file(self, file_obj, form=None, link=None):
         """
         Loads the file from the server and stores it into
         the file object given as a parameter. The form
-        parameter is the mechanize Form to be submitted for downloading
-        the file.
+        parameter is the download form (see download_forms()) to be
+        submitted for downloading the file.
 
         The file parameter has to be an object of type
         model.file.File.
         """
         logging.info("Getting file '%s'", file_obj.originalId)
         if form:
-            mechanize_request = form.click()
+            mechanize_request = self.form_request(form)
         elif link:
             mechanize_request = mechanize.Request(link)
         else:
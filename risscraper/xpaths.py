@@ -0,0 +1,92 @@
+# encoding: utf-8
+
+"""
+Copyright (c) 2012 - 2015, Marian Steinbach, Ernesto Ruge
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+   notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+   notice, this list of conditions and the following disclaimer in the
+   documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+   contributors may be used to endorse or promote products derived from
+   this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A
+PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import time
+
+from lxml import etree
+
+import metrics
+
+
+# scraper type -> XPathRegistry
+registries = {}
+
+
+def get_registry(scraper_type, expressions):
+    """
+    Return the XPath registry of a scraper type. It is created with the
+    configured expressions of the type on first use and shared by all
+    scrapers of that type afterwards.
+    """
+    registry = registries.get(scraper_type)
+    if registry is None:
+        registry = XPathRegistry(scraper_type, expressions)
+        registries[scraper_type] = registry
+    return registry
+
+
+class XPathRegistry(object):
+    """
+    Compiled XPath expressions. Calling the registry with a node and an
+    expression evaluates the expression, which is compiled only once, and
+    records the time taken in metrics as "xpath <type>: <expression>".
+
+    Text results are plain strings (smart_strings=False), so they don't
+    keep their element alive.
+    """
+
+    def __init__(self, scraper_type, expressions):
+        self.scraper_type = scraper_type
+        self.compiled = {}
+        for expression in expressions.itervalues():
+            try:
+                self.compile(expression)
+            except (etree.XPathSyntaxError, TypeError):
+                # the configuration also contains e.g. class names
+                pass
+
+    def compile(self, expression):
+        selector = self.compiled.get(expression)
+        if selector is None:
+            selector = etree.XPath(expression, smart_strings=False)
+            self.compiled[expression] = selector
+        return selector
+
+    def __call__(self, node, expression):
+        selector = self.compile(expression)
+        start = time.time()
+        result = selector(node)
+        metrics.add_time('xpath %s: %s' % (self.scraper_type, expression),
+                         time.time() - start)
+        return result